@@ -18,6 +18,27 @@ class ConfigClass:
         self.toStem = False
         self.google_news_vectors_negative300_path = '../../../../GoogleNews-vectors-negative300.bin'
         self.glove_twitter_27B_25d_path = '../../../../glove.twitter.27B.25d.txt'
+        # number of tweets that read from the parquet file at once when building the index.
+        self.parquet_batch_size = 10000
+        # number of processes that parse the tweets when building the index (1 means no process pool).
+        self.parse_processes = 1
+        # max number of batches that wait between the read, parse and index stages of the build, which run at
+        # the same time. 0 reads, parses and indexes every batch in turn. the stages overlap well only with parse
+        # processes, in one process the parse and index threads share the GIL.
+        self.ingestion_queue_size = 0
+        # memory budget (bytes) of the postings while building the index. when it is reached the postings are
+        # flushed to sorted run files that are merged at the end of the build. None builds the index in memory.
+        self.index_memory_budget = None
+        # folder of the external memory builds, every build writes its run files and merged index to its own
+        # sub folder.
+        self.index_work_dir = 'index_work'
+        # save the impact order (descending tf) of every posting list with the index, for anytime search.
+        self.impact_ordered_postings = False
+        # max number of queries and memory budget (bytes) of the search result cache, 0 queries to not cache.
+        self.query_cache_size = 1024
+        self.query_cache_memory = 32 * 1024 * 1024
+        # number of processes that score the queries of search_many (1 means no process pool).
+        self.search_processes = 1
 
     def get__corpusPath(self):
         return self.corpusPath
@@ -27,3 +48,30 @@ class ConfigClass:
 
     def get_download_model(self):
         return self._download_model
+
+    def get_parquet_batch_size(self):
+        return self.parquet_batch_size
+
+    def get_parse_processes(self):
+        return self.parse_processes
+
+    def get_ingestion_queue_size(self):
+        return self.ingestion_queue_size
+
+    def get_index_memory_budget(self):
+        return self.index_memory_budget
+
+    def get_index_work_dir(self):
+        return self.index_work_dir
+
+    def get_impact_ordered_postings(self):
+        return self.impact_ordered_postings
+
+    def get_query_cache_size(self):
+        return self.query_cache_size
+
+    def get_query_cache_memory(self):
+        return self.query_cache_memory
+
+    def get_search_processes(self):
+        return self.search_processes
@@ -0,0 +1,548 @@
+"""
+binary on-disk index made of three files:
+    <fn>.lex  - header, the fingerprint of the terms and fixed size entries sorted by term, followed by the terms
+                as utf-8 bytes.
+    <fn>.post - blob with the postings of all the terms: the doc gaps and the freqs as variable byte numbers,
+                and optionally the impact order of the postings int32. the tf of a posting is not saved, it is
+                freq / unique terms of the doc, so it is calculated from the per-doc table when the list is read.
+    <fn>.docs - header and the per-doc table (tweet ids, dates, weight of docs, unique terms).
+    <fn>.spell - the spelling corrector of the index: the deletes sorted by their utf-8 bytes, like the lexicon,
+                and for every delete the indexes of its terms, followed by the terms and their df.
+all the files are opened with mmap, so only the pages that a query touches are read from disk,
+and processes that open the same index share the page cache.
+"""
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+import numpy as np
+from posting_list import PostingList
+
+LEXICON_MAGIC = b'SELX'
+POSTINGS_MAGIC = b'SEPS'
+DOCS_MAGIC = b'SEDC'
+SPELL_MAGIC = b'SESP'
+VERSION = 7
+# magic, version, byte order (0 little / 1 big), number of entries, flags
+HEADER = struct.Struct('<4sIIII')
+# flag of the postings file: the impact order of every posting list is saved after it.
+FLAG_IMPACT_ORDER = 1
+# lexicon_fingerprint of the terms, as hex digits
+LEXICON_FINGERPRINT = struct.Struct('<40s')
+# term offset, term length, df, idf, postings offset, number of postings, bytes of the doc gaps, bytes of the freqs
+LEXICON_ENTRY = struct.Struct('<QIIdQIII')
+# max edit distance, prefix length, number of terms of the spelling corrector
+SPELL_INFO = struct.Struct('<IIQ')
+
+
+def _byte_order_flag():
+    return 0 if sys.byteorder == 'little' else 1
+
+
+def _pad_to_8(f):
+    """
+    write zeros until the file position is a multiple of 8, so the next array can be cast in place.
+    :param f: file opened for binary writing
+    :return:
+    """
+    reminder = f.tell() % 8
+    if reminder:
+        f.write(b'\0' * (8 - reminder))
+
+
+def encode_varbyte(values):
+    """
+    encode non negative numbers as variable byte: 7 bits in every byte, the low bits first, and the high bit
+    is set in all the bytes of a number except its last byte.
+    :param values: numpy array of numbers smaller than 2^32
+    :return: bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        n_bytes += values >= (1 << shift)
+    starts = np.cumsum(n_bytes) - n_bytes
+    encoded = np.zeros(int(n_bytes.sum()), dtype=np.uint8)
+    for byte_idx in range(int(n_bytes.max()) if len(values) > 0 else 0):
+        has_byte = n_bytes > byte_idx
+        byte = (values[has_byte] >> np.uint64(7 * byte_idx)) & np.uint64(0x7f)
+        byte |= np.where(n_bytes[has_byte] > byte_idx + 1, 0x80, 0).astype(np.uint64)
+        encoded[starts[has_byte] + byte_idx] = byte
+    return encoded.tobytes()
+
+
+def decode_varbyte(buffer, n_values):
+    """
+    decode the numbers of encode_varbyte, all of them at once with numpy.
+    :param buffer: buffer with the encoded numbers
+    :param n_values: number of encoded numbers
+    :return: numpy uint32 array
+    """
+    encoded = np.frombuffer(buffer, dtype=np.uint8)
+    if len(encoded) == n_values:
+        # every number is smaller than 128, this is the common case of freqs and of gaps in long lists.
+        return encoded.astype(np.uint32)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.empty(n_values, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # position of every byte in its number.
+    byte_idx = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    parts = (encoded & 0x7f).astype(np.uint64) << (7 * byte_idx).astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.uint32)
+
+
+def _open_mmap(path, magic):
+    """
+    open a file of the index with mmap and check its header.
+    :param path: path of the file
+    :param magic: the magic bytes that the file must start with
+    :return: (mmap object, number of entries in the file, flags)
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    file_magic, version, byte_order, n_entries, flags = HEADER.unpack_from(mm, 0)
+    if file_magic != magic or version != VERSION:
+        raise ValueError('{} is not an index file of version {}'.format(path, VERSION))
+    if byte_order != _byte_order_flag():
+        raise ValueError('{} was written on a machine with different byte order'.format(path))
+    return mm, n_entries, flags
+
+
+def lexicon_fingerprint(sorted_terms):
+    """
+    :param sorted_terms: the terms of a lexicon in sorted order
+    :return: hash of the terms (hex digits), the tables that are built from a lexicon depend only on its terms.
+    """
+    lexicon_hash = hashlib.sha1()
+    for term in sorted_terms:
+        lexicon_hash.update(term.encode('utf-8', 'surrogatepass'))
+        lexicon_hash.update(b'\0')
+    return lexicon_hash.hexdigest()
+
+
+def index_prefix(fn):
+    """
+    :param fn: prefix of the index files, or the name of a pickled index (the .pkl is dropped)
+    :return: the prefix of the binary index files
+    """
+    if fn.endswith('.pkl'):
+        return fn[:-len('.pkl')]
+    return fn
+
+
+def write_index(fn, inverted_idx, postingDict, doc_ids, doc_dates, weight_of_docs, doc_unique_terms,
+                impact_orders=None):
+    """
+    write the index to the binary files <fn>.lex, <fn>.post and <fn>.docs.
+    :param fn: prefix of the index files
+    :param inverted_idx: {term : (df, idf)}
+    :param postingDict: {term : PostingList}
+    :param doc_ids: tweet id of every doc ordinal
+    :param doc_dates: date of every doc ordinal
+    :param weight_of_docs: sqrt(w_ij^2) of every doc ordinal
+    :param doc_unique_terms: number of unique terms of every doc ordinal
+    :param impact_orders: {term : positions of the postings by descending tf} or None to not save them
+    :return:
+    """
+    index_writer = IndexWriter(fn, impact_orders is not None)
+    for term in inverted_idx:
+        df, idf = inverted_idx[term]
+        impact_order = impact_orders[term] if impact_orders is not None else None
+        index_writer.add_term(term, df, idf, postingDict[term], impact_order)
+    index_writer.close(doc_ids, doc_dates, weight_of_docs, doc_unique_terms)
+
+
+class IndexWriter:
+    """
+    write the binary index one term at a time, so the postings don't have to be in memory together.
+    only the lexicon entries are kept in memory until close.
+    """
+
+    def __init__(self, fn, with_impact_order=False):
+        """
+        :param fn: prefix of the index files
+        :param with_impact_order: save the impact order of every posting list after it
+        """
+        self._fn = fn
+        self._entries = {}
+        self._with_impact_order = with_impact_order
+        self._postings_file = open(fn + '.post', 'wb')
+        # the number of terms is unknown yet, the postings file doesn't need it.
+        flags = FLAG_IMPACT_ORDER if with_impact_order else 0
+        self._postings_file.write(HEADER.pack(POSTINGS_MAGIC, VERSION, _byte_order_flag(), 0, flags))
+        _pad_to_8(self._postings_file)
+
+    def add_term(self, term, df, idf, posting_list, impact_order=None):
+        """
+        write the postings of the term. adding a term that was already added replaces its entry.
+        :param term: the term
+        :param df: number of docs of the term
+        :param idf: idf of the term
+        :param posting_list: PostingList of the term
+        :param impact_order: positions of the postings by descending tf, needed when the writer saves impact orders
+        :return:
+        """
+        f = self._postings_file
+        offset = f.tell()
+        # the docs are sorted, so the gaps between them are small numbers.
+        docs = np.frombuffer(array('i', posting_list.docs), dtype=np.int32)
+        encoded_gaps = encode_varbyte(np.diff(docs, prepend=0))
+        encoded_freqs = encode_varbyte(np.frombuffer(array('H', posting_list.freqs), dtype=np.uint16))
+        f.write(encoded_gaps)
+        f.write(encoded_freqs)
+        if self._with_impact_order:
+            _pad_to_8(f)
+            f.write(array('i', impact_order).tobytes())
+        self._entries[term] = (df, idf, offset, len(posting_list), len(encoded_gaps), len(encoded_freqs))
+
+    def close(self, doc_ids, doc_dates, weight_of_docs, doc_unique_terms):
+        """
+        write the lexicon and the per-doc table and close the files.
+        :param doc_ids: tweet id of every doc ordinal
+        :param doc_dates: date of every doc ordinal
+        :param weight_of_docs: sqrt(w_ij^2) of every doc ordinal
+        :param doc_unique_terms: number of unique terms of every doc ordinal
+        :return:
+        """
+        self._postings_file.close()
+
+        # the lexicon is sorted by the utf-8 bytes, this is the order that the binary search compares.
+        encoded_terms = sorted((term.encode('utf-8'), term) for term in self._entries)
+        terms_blob = bytearray()
+        with open(self._fn + '.lex', 'wb') as f:
+            f.write(HEADER.pack(LEXICON_MAGIC, VERSION, _byte_order_flag(), len(encoded_terms), 0))
+            # the order of the utf-8 bytes is the order of the terms.
+            fingerprint = lexicon_fingerprint(term for _, term in encoded_terms)
+            f.write(LEXICON_FINGERPRINT.pack(fingerprint.encode('ascii')))
+            for encoded_term, term in encoded_terms:
+                f.write(LEXICON_ENTRY.pack(len(terms_blob), len(encoded_term), *self._entries[term]))
+                terms_blob += encoded_term
+            f.write(terms_blob)
+
+        with open(self._fn + '.docs', 'wb') as f:
+            f.write(HEADER.pack(DOCS_MAGIC, VERSION, _byte_order_flag(), len(doc_ids), 0))
+            _pad_to_8(f)
+            f.write(array('q', doc_ids).tobytes())
+            f.write(array('q', doc_dates).tobytes())
+            f.write(array('d', weight_of_docs).tobytes())
+            f.write(array('H', doc_unique_terms).tobytes())
+
+
+class DiskLexicon(Mapping):
+    """
+    read only {term : (df, idf)} mapping over the mmap of <fn>.lex, the term is found with binary search.
+    the fingerprint of the terms is read from the file, it is not calculated again.
+    """
+
+    def __init__(self, path):
+        self._mm, self._n_terms, _ = _open_mmap(path, LEXICON_MAGIC)
+        self.fingerprint = LEXICON_FINGERPRINT.unpack_from(self._mm, HEADER.size)[0].decode('ascii')
+        self._entries_start = HEADER.size + LEXICON_FINGERPRINT.size
+        self._terms_start = self._entries_start + self._n_terms * LEXICON_ENTRY.size
+
+    def _entry(self, idx):
+        return LEXICON_ENTRY.unpack_from(self._mm, self._entries_start + idx * LEXICON_ENTRY.size)
+
+    def _term_bytes(self, entry):
+        start = self._terms_start + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def find(self, term):
+        """
+        binary search of the term in the lexicon.
+        :param term: term to search
+        :return: the lexicon entry of the term, None if the term is not in the lexicon.
+        """
+        encoded_term = term.encode('utf-8')
+        low = 0
+        high = self._n_terms
+        while low < high:
+            mid = (low + high) // 2
+            entry = self._entry(mid)
+            term_bytes = self._term_bytes(entry)
+            if term_bytes < encoded_term:
+                low = mid + 1
+            elif term_bytes > encoded_term:
+                high = mid
+            else:
+                return entry
+        return None
+
+    def __getitem__(self, term):
+        entry = self.find(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry[2], entry[3]
+
+    def __contains__(self, term):
+        return self.find(term) is not None
+
+    def __len__(self):
+        return self._n_terms
+
+    def __iter__(self):
+        for idx in range(self._n_terms):
+            yield self._term_bytes(self._entry(idx)).decode('utf-8')
+
+
+class DiskPostings(Mapping):
+    """
+    read only {term : PostingList} mapping over the mmap of <fn>.post, the posting list of a term is decoded
+    when it is read.
+    """
+
+    def __init__(self, path, lexicon, doc_unique_terms):
+        """
+        :param path: path of the postings file
+        :param lexicon: DiskLexicon of the index
+        :param doc_unique_terms: number of unique terms of every doc ordinal, to calculate the tf of the postings
+        """
+        self._mm, _, flags = _open_mmap(path, POSTINGS_MAGIC)
+        self._view = memoryview(self._mm)
+        self._lexicon = lexicon
+        self._doc_unique_terms = np.frombuffer(doc_unique_terms, dtype=np.uint16)
+        self.with_impact_order = bool(flags & FLAG_IMPACT_ORDER)
+
+    def posting_list_at(self, offset, n_postings, gaps_size, freqs_size):
+        """
+        decode a posting list of the blob.
+        :param offset: offset of the posting list in the blob
+        :param n_postings: number of postings
+        :param gaps_size: number of bytes of the encoded doc gaps
+        :param freqs_size: number of bytes of the encoded freqs
+        :return: PostingList
+        """
+        posting_list = PostingList()
+        if n_postings == 0:
+            return posting_list
+        freqs_offset = offset + gaps_size
+        docs = np.cumsum(decode_varbyte(self._view[offset:freqs_offset], n_postings), dtype=np.int32)
+        freqs = decode_varbyte(self._view[freqs_offset:freqs_offset + freqs_size], n_postings).astype(np.uint16)
+        # the same float32 tf that the indexer calculates.
+        tfs = (freqs / self._doc_unique_terms[docs].astype(np.float64)).astype(np.float32)
+        posting_list.docs.frombytes(docs.tobytes())
+        posting_list.freqs.frombytes(freqs.tobytes())
+        posting_list.weights.frombytes(tfs.tobytes())
+        return posting_list
+
+    def impact_order_at(self, offset, n_postings, gaps_size, freqs_size):
+        """
+        :param offset: offset of the posting list in the blob
+        :param n_postings: number of postings
+        :param gaps_size: number of bytes of the encoded doc gaps
+        :param freqs_size: number of bytes of the encoded freqs
+        :return: view of the positions of the postings by descending tf, it is saved after the posting list.
+        """
+        impact_offset = offset + gaps_size + freqs_size
+        impact_offset += -impact_offset % 8
+        return self._view[impact_offset:impact_offset + 4 * n_postings].cast('i')
+
+    def __getitem__(self, term):
+        entry = self._lexicon.find(term)
+        if entry is None:
+            raise KeyError(term)
+        return self.posting_list_at(*entry[4:8])
+
+    def __contains__(self, term):
+        return term in self._lexicon
+
+    def __len__(self):
+        return len(self._lexicon)
+
+    def __iter__(self):
+        return iter(self._lexicon)
+
+
+class DiskImpactOrders(Mapping):
+    """
+    read only {term : positions of the postings by descending tf} mapping over the postings file,
+    it is empty when the index was saved without impact orders.
+    """
+
+    def __init__(self, lexicon, postings):
+        self._lexicon = lexicon
+        self._postings = postings
+
+    def __getitem__(self, term):
+        entry = self._lexicon.find(term) if self._postings.with_impact_order else None
+        if entry is None:
+            raise KeyError(term)
+        return self._postings.impact_order_at(*entry[4:8])
+
+    def __len__(self):
+        return len(self._lexicon) if self._postings.with_impact_order else 0
+
+    def __iter__(self):
+        return iter(self._lexicon) if self._postings.with_impact_order else iter(())
+
+
+def write_spelling_corrector(path, max_edit_distance, prefix_length, terms, dfs, deletes):
+    """
+    write the tables of a spelling corrector to a file that read_spelling_corrector opens with mmap.
+    :param path: path of the file
+    :param max_edit_distance: max edit distance of the corrector
+    :param prefix_length: prefix length of the corrector
+    :param terms: list of the terms
+    :param dfs: df of every term
+    :param deletes: {delete of a prefix : [term index ...]}
+    :return:
+    """
+    term_offsets = array('Q', [0])
+    terms_blob = bytearray()
+    for term in terms:
+        terms_blob += term.encode('utf-8')
+        term_offsets.append(len(terms_blob))
+    # the deletes are sorted by the utf-8 bytes, this is the order that the binary search compares.
+    encoded_deletes = sorted((delete.encode('utf-8'), delete) for delete in deletes)
+    delete_offsets = array('Q', [0])
+    delete_terms_offsets = array('Q', [0])
+    delete_terms = array('I')
+    deletes_blob = bytearray()
+    for encoded_delete, delete in encoded_deletes:
+        deletes_blob += encoded_delete
+        delete_offsets.append(len(deletes_blob))
+        delete_terms.extend(deletes[delete])
+        delete_terms_offsets.append(len(delete_terms))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(SPELL_MAGIC, VERSION, _byte_order_flag(), len(encoded_deletes), 0))
+        f.write(SPELL_INFO.pack(max_edit_distance, prefix_length, len(terms)))
+        _pad_to_8(f)
+        f.write(term_offsets.tobytes())
+        f.write(delete_offsets.tobytes())
+        f.write(delete_terms_offsets.tobytes())
+        f.write(array('I', dfs).tobytes())
+        f.write(delete_terms.tobytes())
+        f.write(terms_blob)
+        f.write(deletes_blob)
+
+
+class DiskTerms(Sequence):
+    """
+    read only list of the terms of the spelling corrector over its mmap.
+    """
+
+    def __init__(self, mm, offsets, blob_start):
+        """
+        :param mm: mmap of the file
+        :param offsets: offset of every term in the terms blob, and the end of the blob
+        :param blob_start: position of the terms blob in the file
+        """
+        self._mm = mm
+        self._offsets = offsets
+        self._blob_start = blob_start
+
+    def __getitem__(self, idx):
+        start = self._blob_start + self._offsets[idx]
+        return self._mm[start:self._blob_start + self._offsets[idx + 1]].decode('utf-8')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class DiskDeletes(Mapping):
+    """
+    read only {delete of a prefix : term indexes} mapping of the spelling corrector over its mmap,
+    the delete is found with binary search.
+    """
+
+    def __init__(self, mm, offsets, blob_start, terms_offsets, delete_terms):
+        """
+        :param mm: mmap of the file
+        :param offsets: offset of every delete in the deletes blob, and the end of the blob
+        :param blob_start: position of the deletes blob in the file
+        :param terms_offsets: position of the term indexes of every delete in delete_terms, and their end
+        :param delete_terms: the term indexes of all the deletes
+        """
+        self._mm = mm
+        self._offsets = offsets
+        self._blob_start = blob_start
+        self._terms_offsets = terms_offsets
+        self._delete_terms = delete_terms
+
+    def _delete_bytes(self, idx):
+        return self._mm[self._blob_start + self._offsets[idx]:self._blob_start + self._offsets[idx + 1]]
+
+    def find(self, delete):
+        """
+        binary search of the delete.
+        :param delete: delete to search
+        :return: index of the delete, None if it is not in the corrector.
+        """
+        encoded_delete = delete.encode('utf-8')
+        low = 0
+        high = len(self._offsets) - 1
+        while low < high:
+            mid = (low + high) // 2
+            delete_bytes = self._delete_bytes(mid)
+            if delete_bytes < encoded_delete:
+                low = mid + 1
+            elif delete_bytes > encoded_delete:
+                high = mid
+            else:
+                return mid
+        return None
+
+    def __getitem__(self, delete):
+        idx = self.find(delete)
+        if idx is None:
+            raise KeyError(delete)
+        return self._delete_terms[self._terms_offsets[idx]:self._terms_offsets[idx + 1]]
+
+    def __contains__(self, delete):
+        return self.find(delete) is not None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._delete_bytes(idx).decode('utf-8')
+
+
+def read_spelling_corrector(path):
+    """
+    open the tables of a spelling corrector that write_spelling_corrector wrote, as views on its mmap.
+    :param path: path of the file
+    :return: (max edit distance, prefix length, terms, dfs, deletes)
+    """
+    mm, n_deletes, _ = _open_mmap(path, SPELL_MAGIC)
+    view = memoryview(mm)
+    max_edit_distance, prefix_length, n_terms = SPELL_INFO.unpack_from(mm, HEADER.size)
+    offset = HEADER.size + SPELL_INFO.size
+    offset += -offset % 8
+    term_offsets = view[offset:offset + 8 * (n_terms + 1)].cast('Q')
+    offset += 8 * (n_terms + 1)
+    delete_offsets = view[offset:offset + 8 * (n_deletes + 1)].cast('Q')
+    offset += 8 * (n_deletes + 1)
+    delete_terms_offsets = view[offset:offset + 8 * (n_deletes + 1)].cast('Q')
+    offset += 8 * (n_deletes + 1)
+    dfs = view[offset:offset + 4 * n_terms].cast('I')
+    offset += 4 * n_terms
+    n_delete_terms = delete_terms_offsets[n_deletes]
+    delete_terms = view[offset:offset + 4 * n_delete_terms].cast('I')
+    offset += 4 * n_delete_terms
+    terms = DiskTerms(mm, term_offsets, offset)
+    deletes = DiskDeletes(mm, delete_offsets, offset + term_offsets[n_terms], delete_terms_offsets, delete_terms)
+    return max_edit_distance, prefix_length, terms, dfs, deletes
+
+
+def read_doc_table(path):
+    """
+    open the per-doc table of <fn>.docs as views on its mmap.
+    :param path: path of the docs file
+    :return: (doc_ids, doc_dates, weight_of_docs, doc_unique_terms)
+    """
+    mm, n_docs, _ = _open_mmap(path, DOCS_MAGIC)
+    view = memoryview(mm)
+    offset = HEADER.size + (-HEADER.size % 8)
+    doc_ids = view[offset:offset + 8 * n_docs].cast('q')
+    offset += 8 * n_docs
+    doc_dates = view[offset:offset + 8 * n_docs].cast('q')
+    offset += 8 * n_docs
+    weight_of_docs = view[offset:offset + 8 * n_docs].cast('d')
+    offset += 8 * n_docs
+    doc_unique_terms = view[offset:offset + 2 * n_docs].cast('H')
+    return doc_ids, doc_dates, weight_of_docs, doc_unique_terms
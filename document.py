@@ -1,32 +1,36 @@
+from array import array
+
 
 class Document:
+    # the documents are made for every tweet of the corpus, __slots__ keeps them small (no __dict__ per doc).
+    __slots__ = ('tweet_id', 'tweet_date', 'terms', 'freqs', 'doc_length', 'max_tf', 'unique_words_number',
+                 'full_text')
 
-    def __init__(self, tweet_id, tweet_date=None, full_text=None, url=None, retweet_text=None, retweet_url=None,
-                 quote_text=None, quote_url=None, term_doc_dictionary=None, doc_length=0, max_tf=0,
-                 unique_words_number=0):
+    def __init__(self, tweet_id, tweet_date=None, terms=(), freqs=None, doc_length=0, max_tf=0,
+                 unique_words_number=0, full_text=None):
         """
-        :param tweet_id: tweet id
-        :param tweet_date: tweet date
-        :param full_text: full text as string from tweet
-        :param url: url
-        :param retweet_text: retweet text
-        :param retweet_url: retweet url
-        :param quote_text: quote text
-        :param quote_url: quote url
-        :param term_doc_dictionary: dictionary of term and documents.
+        only the fields that the indexer uses are kept, the text of the tweet is kept only when asked.
+        :param tweet_id: tweet id (int)
+        :param tweet_date: tweet date as int (yyyymmddhhmmss)
+        :param terms: tuple of the unique terms of the parsed doc, in the order of their first appearance.
+        :param freqs: array of the number of appearances of every term, parallel to terms.
         :param doc_length: doc length
         :param max_tf: max appearances of term in the parsed doc
         :param unique_words_number: number of unique terms in the parsed doc
+        :param full_text: full text as string from tweet, None when it is not kept.
         """
         self.tweet_id = tweet_id
         self.tweet_date = tweet_date
-        self.full_text = full_text
-        self.url = url
-        self.retweet_text = retweet_text
-        self.retweet_url = retweet_url
-        self.quote_text = quote_text
-        self.quote_url = quote_url
-        self.term_doc_dictionary = term_doc_dictionary
+        self.terms = terms
+        self.freqs = freqs if freqs is not None else array('H')
         self.doc_length = doc_length
         self.max_tf = max_tf
         self.unique_words_number = unique_words_number
+        self.full_text = full_text
+
+    @property
+    def term_doc_dictionary(self):
+        """
+        :return: dictionary of term and number of appearances in the doc, made from the parallel arrays.
+        """
+        return dict(zip(self.terms, self.freqs))
@@ -0,0 +1,364 @@
+import queue
+import threading
+import time
+from multiprocessing import Pool
+from reader import ReadFile
+from parser_module import Parse
+from indexer import Indexer
+
+# parser and config of a worker process in parallel build.
+_worker_parser = None
+_worker_config = None
+# marks the end of the batches in the queues of the ingestion pipeline.
+_END_OF_BATCHES = None
+
+
+def index_parquet_file(parser, indexer, fn, config):
+    """
+    read the parquet file in batches, parse every tweet and add it to the indexer.
+    when config asks for more than one process, the batches are parsed in a process pool.
+    when config gives an ingestion queue size, the reading, the parsing and the indexing run at the same time
+    (index_batches_pipelined) and their statistics are saved in indexer.last_ingestion_stats.
+    :param parser: the parser of the search engine
+    :param indexer: the indexer of the search engine
+    :param fn: path to parquet file
+    :param config: ConfigClass or None
+    :return: number of documents that were indexed
+    """
+    reader = ReadFile(corpus_path="")
+    batch_size = config.get_parquet_batch_size() if config is not None else None
+    processes = config.get_parse_processes() if config is not None else 1
+    queue_size = config.get_ingestion_queue_size() if config is not None else 0
+    documents_batches = reader.read_file_batches(fn, batch_size)
+    if queue_size > 0:
+        return index_batches_pipelined(parser, indexer, documents_batches, processes, queue_size, config)
+    if processes > 1:
+        return index_batches_parallel(parser, indexer, documents_batches, processes, config)
+
+    number_of_documents = 0
+    for documents_list in documents_batches:
+        # Iterate over every document in the batch
+        for document in documents_list:
+            # parse the document
+            parsed_document = parser.parse_doc(document)
+            number_of_documents += 1
+            # index the document data
+            indexer.add_new_doc(parsed_document)
+    return number_of_documents
+
+
+def append_parquet_file(parser, indexer, fn, config):
+    """
+    index the tweets of a new parquet file as a new segment of a finalized index, and start recalculating
+    the weight of the older docs in the background.
+    :param parser: the parser of the search engine
+    :param indexer: the finalized indexer of the search engine
+    :param fn: path to parquet file
+    :param config: ConfigClass or None
+    :return: number of documents that were indexed
+    """
+    segment_indexer = Indexer(config)
+    segment_indexer.first_doc_ordinal = indexer.number_of_docs()
+    # a segment is kept in memory.
+    segment_indexer.memory_budget = None
+    number_of_documents = index_parquet_file(parser, segment_indexer, fn, config)
+    indexer.append_segment(segment_indexer, parser)
+    indexer.recompute_weight_of_docs_in_background()
+    return number_of_documents
+
+
+def index_batches_parallel(parser, indexer, documents_batches, processes, config=None):
+    """
+    parse and index the batches in a process pool. every worker builds a partial index and partial parser state
+    for its batch, and the partials are merged in the order of the batches, so the result is the same index
+    that a single process builds.
+    :param parser: the parser of the search engine, its corpus state is merged with the workers state.
+    :param indexer: the indexer of the search engine, the partial indexes are merged to it.
+    :param documents_batches: iterable of lists of tweets
+    :param processes: number of worker processes
+    :param config: ConfigClass or None
+    :return: number of documents that were indexed
+    """
+    number_of_documents = 0
+    with Pool(processes, initializer=_init_worker, initargs=(parser.with_stemmer, config)) as pool:
+        for partial_indexer, upper_case_dict, names_and_entities in \
+                pool.imap(_parse_batch, _batches_with_first_ordinal(indexer, documents_batches)):
+            indexer.merge_partial_index(partial_indexer)
+            parser.merge_corpus_state(upper_case_dict, names_and_entities)
+            number_of_documents += len(partial_indexer.doc_ids)
+    return number_of_documents
+
+
+class _PipelineStage:
+    """
+    counters of one stage of the ingestion pipeline.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.batches = 0
+        self.documents = 0
+        # time that the stage worked on batches (summed over its workers), and time it waited for the queues.
+        self.busy_seconds = 0.0
+        self.waiting_seconds = 0.0
+
+    def stats(self):
+        """
+        :return: dict of the counters. documents_per_second is the throughput of the stage when it never waits,
+                 the stage with the lowest throughput is the bottleneck of the pipeline.
+        """
+        return {'workers': self.workers,
+                'batches': self.batches,
+                'documents': self.documents,
+                'busy_seconds': self.busy_seconds,
+                'waiting_seconds': self.waiting_seconds,
+                'documents_per_second': self.documents * self.workers / self.busy_seconds
+                if self.busy_seconds > 0 else 0.0}
+
+
+class _PipelineQueue:
+    """
+    bounded queue between two stages of the ingestion pipeline. a full queue blocks the producer (backpressure),
+    and the depth of the queue is sampled on every get.
+    """
+
+    def __init__(self, max_size, stop):
+        """
+        :param max_size: max number of batches in the queue
+        :param stop: threading.Event that is set when the pipeline stops, so a blocked producer doesn't wait forever
+        """
+        self._queue = queue.Queue(max_size)
+        self._stop = stop
+        self.max_size = max_size
+        self._depth_samples = 0
+        self._depth_sum = 0
+        self._max_depth = 0
+
+    def put(self, item, stage):
+        """
+        :param item: batch (or _END_OF_BATCHES)
+        :param stage: _PipelineStage of the producer, the time it was blocked is added to its waiting time
+        :return: False if the pipeline stopped before the item was put
+        """
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            stage.waiting_seconds += time.perf_counter() - start
+
+    def get(self, stage):
+        """
+        :param stage: _PipelineStage of the consumer, the time it waited is added to its waiting time
+        :return: the next item, _END_OF_BATCHES if the pipeline stopped
+        """
+        depth = self._queue.qsize()
+        self._depth_samples += 1
+        self._depth_sum += depth
+        self._max_depth = max(self._max_depth, depth)
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _END_OF_BATCHES
+        finally:
+            stage.waiting_seconds += time.perf_counter() - start
+
+    def stats(self):
+        """
+        :return: dict of the depths of the queue, a queue that is mostly full comes before the bottleneck.
+        """
+        return {'max_size': self.max_size,
+                'max_depth': self._max_depth,
+                'mean_depth': self._depth_sum / self._depth_samples if self._depth_samples > 0 else 0.0}
+
+
+def _read_stage(documents_batches, read_queue, read_stage, errors):
+    """
+    read the batches of tweets (decompression and normalization of the columns) into the read queue.
+    """
+    try:
+        batches = iter(documents_batches)
+        while True:
+            start = time.perf_counter()
+            documents_list = next(batches, _END_OF_BATCHES)
+            read_stage.busy_seconds += time.perf_counter() - start
+            if documents_list is _END_OF_BATCHES:
+                break
+            read_stage.batches += 1
+            read_stage.documents += len(documents_list)
+            if not read_queue.put(documents_list, read_stage):
+                return
+    except Exception as e:
+        errors.append(e)
+    read_queue.put(_END_OF_BATCHES, read_stage)
+
+
+def _parse_stage(parser, pool, first_doc_ordinal, read_queue, parse_queue, parse_stage, errors):
+    """
+    parse the batches of the read queue into the parse queue. without a pool the batches are parsed by this
+    thread to lists of documents, with a pool every batch is sent to a worker (_parse_batch) and the parse queue
+    gets the pending result, so the size of the parse queue bounds the batches that the workers hold.
+    """
+    try:
+        for documents_list in iter(lambda: read_queue.get(parse_stage), _END_OF_BATCHES):
+            if pool is None:
+                start = time.perf_counter()
+                parsed_batch = [parser.parse_doc(document) for document in documents_list]
+                parse_stage.busy_seconds += time.perf_counter() - start
+            else:
+                parsed_batch = pool.apply_async(_parse_batch_timed, ((first_doc_ordinal, documents_list),))
+                first_doc_ordinal += len(documents_list)
+            parse_stage.batches += 1
+            parse_stage.documents += len(documents_list)
+            if not parse_queue.put(parsed_batch, parse_stage):
+                return
+    except Exception as e:
+        errors.append(e)
+    parse_queue.put(_END_OF_BATCHES, parse_stage)
+
+
+def index_batches_pipelined(parser, indexer, documents_batches, processes, queue_size, config=None):
+    """
+    index the batches in a pipeline of three stages that run at the same time, connected by bounded queues:
+        read - a thread reads the batches from the parquet file.
+        parse - a thread parses the batches, or sends them to a process pool when processes > 1 (the workers
+                parse and index every batch to a partial index, like index_batches_parallel).
+        index - this thread adds the documents to the indexer, or merges the partial indexes, in the order of
+                the batches, so the result is the same index as a build without the pipeline.
+    when a stage is slower than the stage before it, its queue fills up and blocks the stage before it, so at most
+    queue_size batches wait between two stages.
+    the statistics of the stages and the queues are saved in indexer.last_ingestion_stats:
+        {'read': ..., 'parse': ..., 'index': ... (_PipelineStage.stats),
+         'read_queue': ..., 'parse_queue': ... (_PipelineQueue.stats), 'seconds': time of the pipeline}
+    :param parser: the parser of the search engine
+    :param indexer: the indexer of the search engine
+    :param documents_batches: iterable of lists of tweets
+    :param processes: number of parse processes, 1 parses in a thread of this process
+    :param queue_size: max number of batches in every queue
+    :param config: ConfigClass or None
+    :return: number of documents that were indexed
+    """
+    start = time.perf_counter()
+    stop = threading.Event()
+    errors = []
+    read_stage, parse_stage, index_stage = _PipelineStage(), _PipelineStage(processes), _PipelineStage()
+    read_queue, parse_queue = _PipelineQueue(queue_size, stop), _PipelineQueue(queue_size, stop)
+    pool = Pool(processes, initializer=_init_worker, initargs=(parser.with_stemmer, config)) \
+        if processes > 1 else None
+    threads = [threading.Thread(target=_read_stage, args=(documents_batches, read_queue, read_stage, errors),
+                                daemon=True),
+               threading.Thread(target=_parse_stage,
+                                args=(parser, pool, indexer.number_of_docs(), read_queue, parse_queue, parse_stage,
+                                      errors),
+                                daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    number_of_documents = 0
+    try:
+        for parsed_batch in iter(lambda: parse_queue.get(index_stage), _END_OF_BATCHES):
+            if pool is None:
+                batch_start = time.perf_counter()
+                for document in parsed_batch:
+                    indexer.add_new_doc(document)
+                n_documents = len(parsed_batch)
+            else:
+                (partial_indexer, upper_case_dict, names_and_entities), worker_seconds = \
+                    _wait_for(parsed_batch, index_stage)
+                parse_stage.busy_seconds += worker_seconds
+                batch_start = time.perf_counter()
+                indexer.merge_partial_index(partial_indexer)
+                parser.merge_corpus_state(upper_case_dict, names_and_entities)
+                n_documents = len(partial_indexer.doc_ids)
+            index_stage.busy_seconds += time.perf_counter() - batch_start
+            index_stage.batches += 1
+            index_stage.documents += n_documents
+            number_of_documents += n_documents
+    finally:
+        # stop the stages if the index stage failed, they don't wait for the queues anymore.
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+    indexer.last_ingestion_stats = {'read': read_stage.stats(),
+                                    'parse': parse_stage.stats(),
+                                    'index': index_stage.stats(),
+                                    'read_queue': read_queue.stats(),
+                                    'parse_queue': parse_queue.stats(),
+                                    'seconds': time.perf_counter() - start}
+    return number_of_documents
+
+
+def _wait_for(async_result, stage):
+    """
+    :param async_result: pending result of the process pool
+    :param stage: _PipelineStage that waits, the time is added to its waiting time
+    :return: the result
+    """
+    start = time.perf_counter()
+    result = async_result.get()
+    stage.waiting_seconds += time.perf_counter() - start
+    return result
+
+
+def _batches_with_first_ordinal(indexer, documents_batches):
+    """
+    attach to every batch the doc ordinal of its first tweet, so the workers give the final ordinals.
+    :param indexer: the indexer that the batches will be merged to
+    :param documents_batches: iterable of lists of tweets
+    :return: generator of (first doc ordinal, batch)
+    """
+    first_doc_ordinal = indexer.number_of_docs()
+    for documents_list in documents_batches:
+        yield first_doc_ordinal, documents_list
+        first_doc_ordinal += len(documents_list)
+
+
+def _init_worker(with_stemmer, config):
+    global _worker_parser, _worker_config
+    _worker_parser = Parse(with_stemmer)
+    _worker_config = config
+
+
+def _parse_batch(ordinal_and_batch):
+    """
+    parse and index one batch in a worker process.
+    :param ordinal_and_batch: (doc ordinal of the first tweet, list of tweets)
+    :return: (partial indexer, upper case dict of the batch, names and entities of the batch)
+    """
+    first_doc_ordinal, documents_list = ordinal_and_batch
+    # the corpus state of the parser is collected for this batch only.
+    _worker_parser.upper_case_dict = {}
+    _worker_parser.names_and_entities = {}
+    partial_indexer = Indexer(_worker_config)
+    partial_indexer.first_doc_ordinal = first_doc_ordinal
+    # the partial index is small, only the main indexer flushes runs.
+    partial_indexer.memory_budget = None
+    for document in documents_list:
+        partial_indexer.add_new_doc(_worker_parser.parse_doc(document))
+    return partial_indexer, _worker_parser.upper_case_dict, _worker_parser.names_and_entities
+
+
+def _parse_batch_timed(ordinal_and_batch):
+    """
+    _parse_batch that also returns the time the worker worked on the batch.
+    :param ordinal_and_batch: (doc ordinal of the first tweet, list of tweets)
+    :return: (result of _parse_batch, seconds)
+    """
+    start = time.perf_counter()
+    result = _parse_batch(ordinal_and_batch)
+    return result, time.perf_counter() - start
@@ -3,6 +3,51 @@ import utils
 import string
 import os
 import math
+import time
+import logging
+import heapq
+import itertools
+import pickle
+import shutil
+import threading
+import tempfile
+import weakref
+from array import array
+import numpy as np
+from posting_list import PostingList
+from segments import SegmentsLexicon, SegmentsPostings
+import disk_index
+from spelling import SymSpellCorrector, DiskSymSpellCorrector
+
+# estimated memory of a posting and of the posting list of a term, used for the memory budget of the build.
+POSTING_BYTES = 10
+POSTING_LIST_BYTES = 400
+
+
+def _read_run(run_file):
+    """
+    read the records of a run file one by one.
+    :param run_file: path of a run file that flush_run wrote
+    :return: generator of (term, df, docs, freqs) sorted by term
+    """
+    with open(run_file, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _remove_build_dir(build_dir, pid):
+    """
+    delete the folder of an external memory build.
+    :param build_dir: the folder
+    :param pid: the process that made the folder, a forked process doesn't delete the folder of its parent.
+    :return:
+    """
+    if os.getpid() == pid:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
 
 # DO NOT MODIFY CLASS NAME
 class Indexer:
@@ -10,10 +55,51 @@ class Indexer:
     # You can change the internal implementation as you see fit.
     def __init__(self, config):
         self.inverted_idx = {}
+        # {term : PostingList} the postings of every term are saved as parallel arrays.
         self.postingDict = {}
-        self.terms_in_docs = {}
-        self.weight_of_docs = {}
+        # per-doc table, indexed by the doc ordinal that saved in the postings.
+        self.doc_ids = array('q')
+        self.doc_dates = array('q')
+        self.doc_unique_terms = array('H')
+        # sqrt(w_ij^2) of every doc, indexed by doc ordinal.
+        self.weight_of_docs = array('d')
+        # ordinal of the first doc in the per-doc table (not 0 in partial indexes of parallel build).
+        self.first_doc_ordinal = 0
         self.config = config
+        # when the postings in memory pass the memory budget (bytes) they are flushed to a sorted run file,
+        # and finalize_index merges the runs to a binary index. None keeps all the index in memory.
+        self.memory_budget = config.get_index_memory_budget() if config is not None else None
+        self.work_dir = config.get_index_work_dir() if config is not None else 'index_work'
+        self.run_files = []
+        # folder of the run files and of the merged index of this build, made in work_dir by the first flush, so
+        # builds that share work_dir never write over the files of each other (the merged index is mmap'd).
+        # the folder is deleted by cleanup, or when the indexer is garbage collected or the program exits.
+        self.build_dir = None
+        self._build_dir_finalizer = None
+        self.postings_in_memory = 0
+        # incremental updates: the base index keeps its lexicon and postings, and every appended batch of docs
+        # is a segment of postings. inverted_idx and postingDict become views over all of them.
+        self.base_inverted_idx = None
+        self.base_postingDict = None
+        self.base_weight_of_docs = None
+        self.segments = []
+        self.appended_df = {}
+        self._weight_of_docs_thread = None
+        # spelling corrector over the terms of the index, built on first use or opened from the file that was
+        # saved with the index (spelling_corrector_path) on first use.
+        self.spelling_corrector = None
+        self.spelling_corrector_path = None
+        # {term : positions of its postings by descending tf}, for anytime search. they are calculated when the
+        # index is built and saved with it only if the config asks for impact ordered postings.
+        self.impact_ordered_postings = config.get_impact_ordered_postings() if config is not None else False
+        self.impact_orders = {}
+        # changes every time that the search results can change (build, load, append, new weight of docs),
+        # the result cache of the searcher is cleared when it changes.
+        self.generation = 0
+        # wall time (in seconds) of every stage of the last finalize_index call.
+        self.stage_times = collections.OrderedDict()
+        # statistics of the stages and queues of the last pipelined build (index_builder.index_batches_pipelined).
+        self.last_ingestion_stats = None
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
@@ -25,27 +111,188 @@ class Indexer:
         :return: -
         """
 
-        document_dictionary = document.term_doc_dictionary
-        # Go over each term in the doc
-        for term in document_dictionary.keys():
+        terms = document.terms
+        n_unique_terms = len(terms)
+        # give the doc the next ordinal and save its attributes in the per-doc table
+        doc_ordinal = self.number_of_docs()
+        self.doc_ids.append(document.tweet_id)
+        self.doc_dates.append(document.tweet_date)
+        self.doc_unique_terms.append(n_unique_terms)
+        # Go over each term in the doc with its frequency (parallel arrays of the doc)
+        for term, f_ij in zip(terms, document.freqs):
             try:
                 # Update inverted index and posting
-                if term not in self.inverted_idx.keys():
+                if term not in self.inverted_idx:
                     self.inverted_idx[term] = 1
-                    self.postingDict[term] = []
+                    self.postingDict[term] = PostingList()
                 else:
                     self.inverted_idx[term] += 1
 
-                f_ij = document_dictionary[term]
                 # tf_ij = f_ij / document.max_tf #can change the way of normalization
-                tf_ij = f_ij / len(document_dictionary.keys())
-                # add to postingDict[term] list of [doc_id, frequency in doc, tf_ij, doc date]
-                self.postingDict[term].append([document.tweet_id, document_dictionary[term], tf_ij, document.tweet_date])
+                tf_ij = f_ij / n_unique_terms
+                # add to postingDict[term] the posting (doc ordinal, frequency in doc, tf_ij)
+                self.postingDict[term].append(doc_ordinal, f_ij, tf_ij)
 
             except:
                 print('problem with the following key {}'.format(term[0]))
-        # save all the doc terms to calculate sqrt(w_ij^2)
-        self.terms_in_docs[document.tweet_id] = list(document_dictionary.keys())
+        self.postings_in_memory += n_unique_terms
+        self.flush_run_if_needed()
+
+    def number_of_docs(self):
+        """
+        :return: the ordinal that the next doc will get.
+        """
+        return self.first_doc_ordinal + len(self.doc_ids)
+
+    def merge_partial_index(self, partial_indexer):
+        """
+        append a partial index that was built from the docs that come right after the docs of this index.
+        merging the partial indexes in the order of their docs gives the same index as adding the docs one by one.
+        :param partial_indexer: Indexer whose first_doc_ordinal is the number of docs in this index
+        :return:
+        """
+        if partial_indexer.first_doc_ordinal != self.number_of_docs():
+            raise ValueError('partial index starts at doc {} but the index has {} docs'.format(
+                partial_indexer.first_doc_ordinal, self.number_of_docs()))
+        for term, d_ft in partial_indexer.inverted_idx.items():
+            partial_posting_list = partial_indexer.postingDict[term]
+            if term not in self.inverted_idx:
+                self.inverted_idx[term] = d_ft
+                self.postingDict[term] = partial_posting_list
+            else:
+                self.inverted_idx[term] += d_ft
+                posting_list = self.postingDict[term]
+                posting_list.docs.extend(partial_posting_list.docs)
+                posting_list.freqs.extend(partial_posting_list.freqs)
+                posting_list.weights.extend(partial_posting_list.weights)
+        self.doc_ids.extend(partial_indexer.doc_ids)
+        self.doc_dates.extend(partial_indexer.doc_dates)
+        self.doc_unique_terms.extend(partial_indexer.doc_unique_terms)
+        self.postings_in_memory += partial_indexer.postings_in_memory
+        self.flush_run_if_needed()
+
+    def estimated_memory(self):
+        """
+        :return: estimation of the memory (bytes) of the postings that are in memory.
+        """
+        return self.postings_in_memory * POSTING_BYTES + len(self.postingDict) * POSTING_LIST_BYTES
+
+    def flush_run_if_needed(self):
+        """
+        flush the postings to a run file if they pass the memory budget.
+        :return:
+        """
+        if self.memory_budget is not None and self.estimated_memory() > self.memory_budget:
+            self.flush_run()
+
+    def flush_run(self):
+        """
+        write the postings that are in memory to a run file sorted by term, and clear them from memory.
+        the doc ordinals only grow, so concatenating the postings of a term from the runs in their order
+        keeps the posting list sorted by doc.
+        :return:
+        """
+        if len(self.postingDict) == 0:
+            return
+        run_file = os.path.join(self.get_build_dir(), 'run_{}.pkl'.format(len(self.run_files)))
+        with open(run_file, 'wb') as f:
+            for term in sorted(self.postingDict.keys()):
+                posting_list = self.postingDict[term]
+                pickle.dump((term, self.inverted_idx[term], posting_list.docs, posting_list.freqs), f,
+                            pickle.HIGHEST_PROTOCOL)
+        self.run_files.append(run_file)
+        self.inverted_idx = {}
+        self.postingDict = {}
+        self.postings_in_memory = 0
+
+    def get_build_dir(self):
+        """
+        :return: the folder of the files of this build, a new folder in work_dir.
+        """
+        if self.build_dir is None:
+            os.makedirs(self.work_dir, exist_ok=True)
+            self.build_dir = tempfile.mkdtemp(prefix='build_', dir=self.work_dir)
+            self._build_dir_finalizer = weakref.finalize(self, _remove_build_dir, self.build_dir, os.getpid())
+        return self.build_dir
+
+    def cleanup(self):
+        """
+        delete the folder of the external memory build (the run files and the merged index). the index of an
+        external memory build is opened from that folder, so it must not be searched after this call.
+        :return:
+        """
+        if self._build_dir_finalizer is not None:
+            self._build_dir_finalizer()
+            self._build_dir_finalizer = None
+        self.build_dir = None
+
+    def merge_runs(self, parser, corpus_size, fn):
+        """
+        k-way merge of the run files to a binary index, while streaming over the terms it handles the capital
+        letters, calculate idf, tf and sqrt(w_ij^2), and drop the terms that appear only once in corpus.
+        only the per-doc table and the lexicon are kept in memory.
+        :param parser: the parser that parsed the corpus (holds the upper case dictionary).
+        :param corpus_size: number of documents in corpus
+        :param fn: prefix of the binary index files
+        :return:
+        """
+        # the same rules as handle_capital_letters: a word that we saw only with capital letter is saved in upper
+        # case, and replaces the upper case term if it already exists.
+        for word in list(parser.upper_case_dict.keys()):
+            if not parser.upper_case_dict[word]:
+                parser.upper_case_dict.pop(word)
+        replaced_terms = set(word.upper() for word in parser.upper_case_dict)
+
+        segma_w_ij_pow_of_docs = [0.0] * len(self.doc_ids)
+        index_writer = disk_index.IndexWriter(fn, self.impact_ordered_postings)
+        merged_runs = heapq.merge(*[_read_run(run_file) for run_file in self.run_files], key=lambda record: record[0])
+        for term, records in itertools.groupby(merged_runs, key=lambda record: record[0]):
+            if term in parser.upper_case_dict:
+                index_term = term.upper()
+            elif term in replaced_terms:
+                continue
+            else:
+                index_term = term
+            posting_list = PostingList()
+            d_ft = 0
+            for _, run_d_ft, docs, freqs in records:
+                d_ft += run_d_ft
+                posting_list.docs.extend(docs)
+                posting_list.freqs.extend(freqs)
+
+            idf = math.log2((corpus_size / d_ft))
+            for doc_ordinal, freq in zip(posting_list.docs, posting_list.freqs):
+                tf = freq / self.doc_unique_terms[doc_ordinal]
+                posting_list.weights.append(tf)
+                segma_w_ij_pow_of_docs[doc_ordinal] += math.pow(tf * idf, 2)
+
+            # the term is part of the weight of its doc, but we don't keep terms that appear only once in corpus.
+            if d_ft > 1:
+                impact_order = self.impact_order_of_posting_list(posting_list) if self.impact_ordered_postings else None
+                index_writer.add_term(index_term, d_ft, idf, posting_list, impact_order=impact_order)
+
+        self.weight_of_docs = array('d', map(math.sqrt, segma_w_ij_pow_of_docs))
+        index_writer.close(self.doc_ids, self.doc_dates, self.weight_of_docs, self.doc_unique_terms)
+        for run_file in self.run_files:
+            os.remove(run_file)
+        self.run_files = []
+
+    @staticmethod
+    def date_to_int(tweet_date):
+        """
+        change date in format "year/month/day hour" to int that keeps the same order (yyyymmddhhmmss).
+        :param tweet_date: date string of older versions of the parser
+        :return: date as int
+        """
+        return int(tweet_date.replace("/", "").replace(" ", "").replace(":", ""))
+
+    def get_tweet_id(self, doc_ordinal):
+        """
+        map a doc ordinal back to the tweet id.
+        :param doc_ordinal: the doc ordinal that saved in the postings
+        :return: tweet id as string
+        """
+        return str(self.doc_ids[doc_ordinal])
 
     def add_idf_to_inverted_index(self, corpus_size):
         """
@@ -60,34 +307,209 @@ class Indexer:
 
     def build_weight_of_docs(self):
         """
-        calculate sqrt(w_ij^2) and save it in weight_of_docs dictionary.
+        calculate sqrt(w_ij^2) to each doc in one pass over the posting lists, and save the norms in weight_of_docs
+        array. the postings keep the tf, the idf is multiplied at query time so it can follow the corpus size.
+        :return:
+        """
+        self.weight_of_docs = self.calculate_weight_of_docs(self.postingDict, self.first_doc_ordinal,
+                                                            self.doc_unique_terms)
+
+    def calculate_weight_of_docs(self, postings, first_doc_ordinal, doc_unique_terms):
+        """
+        calculate sqrt(w_ij^2) of the docs of the postings with the current idf of every term.
+        :param postings: {term : PostingList}
+        :param first_doc_ordinal: ordinal of the first doc in the postings
+        :param doc_unique_terms: number of unique terms of every doc from first_doc_ordinal
+        :return: array of sqrt(w_ij^2) of the docs from first_doc_ordinal to the last doc
+        """
+        segma_w_ij_pow_of_docs = [0.0] * len(doc_unique_terms)
+        for term, posting_list in postings.items():
+            idf = self.inverted_idx[term][1]
+            freqs = posting_list.freqs
+            for idx, doc_ordinal in enumerate(posting_list.docs):
+                tf = freqs[idx] / doc_unique_terms[doc_ordinal - first_doc_ordinal]
+                tf_idf = tf * idf
+                # accumulate w_ij^2 for the doc of this posting
+                segma_w_ij_pow_of_docs[doc_ordinal - first_doc_ordinal] += math.pow(tf_idf, 2)
+        return array('d', map(math.sqrt, segma_w_ij_pow_of_docs))
+
+    def append_segment(self, segment_indexer, parser):
+        """
+        add a batch of new docs to a finalized index without rebuilding it. the docs are searchable right away:
+        the idf of every term follows the global df, and the weight of the new docs is calculated with it.
+        the weight of the older docs is updated by recompute_weight_of_docs (can run in the background).
+        terms that appear once are not removed from segments, a term can appear again in the next segment.
+        :param segment_indexer: Indexer with the new docs (not finalized), its first doc is the next doc of this index
+        :param parser: the parser that parsed the corpus (holds the upper case dictionary)
+        :return:
+        """
+        # the weights that are calculated in the background must include all the docs before the new segment.
+        self.wait_for_weight_of_docs()
+        if segment_indexer.first_doc_ordinal != self.number_of_docs():
+            raise ValueError('segment starts at doc {} but the index has {} docs'.format(
+                segment_indexer.first_doc_ordinal, self.number_of_docs()))
+        if self.base_inverted_idx is None:
+            self.base_inverted_idx = self.inverted_idx
+            self.base_postingDict = self.postingDict
+            self.base_weight_of_docs = array('d', self.weight_of_docs)
+            # the per-doc table of a loaded index may be read only views.
+            self.doc_ids = array('q', self.doc_ids)
+            self.doc_dates = array('q', self.doc_dates)
+            self.doc_unique_terms = array('H', self.doc_unique_terms)
+            self.weight_of_docs = array('d', self.weight_of_docs)
+            self.inverted_idx = SegmentsLexicon(self.base_inverted_idx, self.appended_df, self)
+            self.postingDict = SegmentsPostings(self.base_postingDict, self.segments, self.inverted_idx)
+
+        # save the terms of the segment the same way they are saved in the index (capital letters rules).
+        segment_postings = {}
+        # (capital letters term, lower case term) of the terms that are saved in lower case from now on.
+        renamed_terms = []
+        for term, d_ft in segment_indexer.inverted_idx.items():
+            upper_term = term.upper()
+            if term in self.inverted_idx or upper_term == term:
+                index_term = term
+            elif upper_term in self.inverted_idx:
+                if parser.upper_case_dict.get(term, True):
+                    index_term = upper_term
+                else:
+                    # the term appeared in lower case, from now on it is saved in lower case.
+                    self.lower_case_term(upper_term, term)
+                    renamed_terms.append((upper_term, term))
+                    index_term = term
+            elif parser.upper_case_dict.get(term, False):
+                index_term = upper_term
+            else:
+                index_term = term
+            segment_postings[index_term] = segment_indexer.postingDict[term]
+            self.appended_df[index_term] = self.appended_df.get(index_term, 0) + d_ft
+        for word in list(parser.upper_case_dict.keys()):
+            if not parser.upper_case_dict[word]:
+                parser.upper_case_dict.pop(word)
+
+        # the per-doc arrays are not resized in place: running queries read them through numpy views, and a
+        # resize under a view raises BufferError. new arrays are built, and doc_ids (the number of docs) is
+        # swapped last so a query never sees more docs than weights.
+        first_doc_ordinal = self.number_of_docs()
+        weight_of_docs = self.weight_of_docs + self.calculate_weight_of_docs(segment_postings, first_doc_ordinal,
+                                                                             segment_indexer.doc_unique_terms)
+        doc_dates = self.doc_dates + segment_indexer.doc_dates
+        doc_unique_terms = self.doc_unique_terms + segment_indexer.doc_unique_terms
+        doc_ids = self.doc_ids + segment_indexer.doc_ids
+        self.weight_of_docs = weight_of_docs
+        self.doc_dates = doc_dates
+        self.doc_unique_terms = doc_unique_terms
+        self.doc_ids = doc_ids
+        self.segments.append(segment_postings)
+        # the terms of the index changed, the corrector is updated with the terms of the segment only.
+        if self.spelling_corrector is not None:
+            self.spelling_corrector.update_terms(self.inverted_idx, segment_postings, renamed_terms)
+        else:
+            # the saved corrector doesn't have the new terms, it is built from the index on first use.
+            self.spelling_corrector_path = None
+        self.impact_orders = {}
+        self.generation += 1
+
+    def lower_case_term(self, upper_term, term):
+        """
+        save a term that is saved in capital letters in lower case, in the base index and in the segments.
+        :param upper_term: the term in capital letters
+        :param term: the term in lower case
         :return:
         """
-        for tweet_id in self.terms_in_docs.keys():
-            segma_w_ij_pow_of_doc = 0
+        if upper_term in self.base_inverted_idx:
+            self.inverted_idx.add_base_alias(term, upper_term)
+        if upper_term in self.appended_df:
+            self.appended_df[term] = self.appended_df.pop(upper_term)
+            for segment_postings in self.segments:
+                if upper_term in segment_postings:
+                    segment_postings[term] = segment_postings.pop(upper_term)
 
-            # calculate w_ij^2 for all docs in corpus
-            for term in self.terms_in_docs[tweet_id]:
-                # change the term to upper case if needed
-                if term.upper() in self.postingDict:
-                    term = term.upper()
-                for list_in_posting in self.postingDict[term]:
-                    # if we find in self.postingDict[term] the doc_id that we calculate the weight now.
-                    if tweet_id == list_in_posting[0]:
-                        tf = list_in_posting[2]
-                        idf = self.inverted_idx[term][1]
-                        tf_idf = tf * idf
-                        list_in_posting.append(tf_idf)
-                        tf_idf_pow = math.pow(tf_idf, 2)
-                        segma_w_ij_pow_of_doc += tf_idf_pow
-                        # the doc appear only once in list_in_posting.
-                        break
+    @staticmethod
+    def impact_order_of_posting_list(posting_list):
+        """
+        :param posting_list: PostingList of a term
+        :return: array of the positions of the postings by descending tf (the order of w_ij, the idf is the same
+                 for all the postings). postings with the same tf keep the doc order.
+        """
+        impact_order = array('i')
+        if len(posting_list) > 0:
+            tfs = np.frombuffer(posting_list.weights, dtype=np.float32)
+            impact_order.frombytes(np.argsort(-tfs, kind='stable').astype(np.int32).tobytes())
+        return impact_order
 
-            sqrt_of_segma_w_ij_pow = math.sqrt(segma_w_ij_pow_of_doc)
-            self.weight_of_docs[tweet_id] = sqrt_of_segma_w_ij_pow
+    def calculate_impact_orders(self):
+        """
+        calculate the impact order of all the posting lists of the index.
+        :return:
+        """
+        self.impact_orders = {}
+        for term in self.inverted_idx:
+            self.impact_orders[term] = self.impact_order_of_posting_list(self.postingDict[term])
 
-        # clear the dictionary to save memory
-        self.terms_in_docs = {}
+    def get_term_impact_order(self, term):
+        """
+        :param term: term of the index
+        :return: positions of the postings of the term by descending tf, calculated now if the index doesn't have it.
+        """
+        if term in self.impact_orders:
+            return self.impact_orders[term]
+        return self.impact_order_of_posting_list(self.get_term_posting_list(term))
+
+    def get_spelling_corrector(self):
+        """
+        :return: SymSpellCorrector over the terms of the index, it is opened or built on the first call.
+        """
+        if self.spelling_corrector is None and self.spelling_corrector_path is not None:
+            self.spelling_corrector = DiskSymSpellCorrector(self.spelling_corrector_path)
+        elif self.spelling_corrector is None:
+            self.spelling_corrector = SymSpellCorrector(self.inverted_idx)
+        return self.spelling_corrector
+
+    def recompute_weight_of_docs(self):
+        """
+        calculate again sqrt(w_ij^2) of all the docs with the current idf, and replace the weight_of_docs array.
+        the terms that appear once were removed from the base index, so the weight of a base doc is not calculated
+        from scratch: the weight it got in the base index is updated with the change of idf of every term it has.
+        :return:
+        """
+        number_of_docs = self.number_of_docs()
+        number_of_base_docs = len(self.base_weight_of_docs)
+        segma_w_ij_pow_of_docs = [math.pow(weight, 2) for weight in self.base_weight_of_docs]
+        segma_w_ij_pow_of_docs.extend([0.0] * (number_of_docs - number_of_base_docs))
+        for term in list(self.inverted_idx):
+            idf = self.inverted_idx[term][1]
+            base_term = self.inverted_idx.base_term(term)
+            base_idf = self.base_inverted_idx[base_term][1] if base_term is not None else 0.0
+            posting_list = self.postingDict[term]
+            freqs = posting_list.freqs
+            for idx, doc_ordinal in enumerate(posting_list.docs):
+                tf = freqs[idx] / self.doc_unique_terms[doc_ordinal]
+                if doc_ordinal < number_of_base_docs:
+                    segma_w_ij_pow_of_docs[doc_ordinal] += math.pow(tf, 2) * (math.pow(idf, 2) - math.pow(base_idf, 2))
+                else:
+                    segma_w_ij_pow_of_docs[doc_ordinal] += math.pow(tf * idf, 2)
+        # max with 0 because of floating point error in the update of a base doc.
+        weight_of_docs = array('d', (math.sqrt(max(segma_w_ij_pow, 0.0)) for segma_w_ij_pow in segma_w_ij_pow_of_docs))
+        self.weight_of_docs = weight_of_docs
+        self.generation += 1
+
+    def wait_for_weight_of_docs(self):
+        """
+        wait until the weight of docs that is calculated in the background (if any) is ready.
+        :return:
+        """
+        if self._weight_of_docs_thread is not None:
+            self._weight_of_docs_thread.join()
+            self._weight_of_docs_thread = None
+
+    def recompute_weight_of_docs_in_background(self):
+        """
+        start recompute_weight_of_docs in a thread, queries keep using the previous weights until it finishes.
+        :return: the thread
+        """
+        self._weight_of_docs_thread = threading.Thread(target=self.recompute_weight_of_docs, daemon=True)
+        self._weight_of_docs_thread.start()
+        return self._weight_of_docs_thread
 
     def handle_capital_letters(self, parser):
         """
@@ -106,25 +528,195 @@ class Indexer:
                 self.inverted_idx.pop(word)
                 self.postingDict.pop(word)
 
+    def finalize_index(self, parser, corpus_size):
+        """
+        run all the stages that turn the raw postings into a searchable index,
+        and save the wall time of every stage in stage_times.
+        :param parser: the parser that parsed the corpus (holds the upper case dictionary).
+        :param corpus_size: number of documents in corpus
+        :return:
+        """
+        self.stage_times = collections.OrderedDict()
+        if self.run_files or self.memory_budget is not None:
+            # external memory build, merge the runs to a binary index and open it.
+            index_fn = os.path.join(self.get_build_dir(), 'index')
+            stages = [
+                ("flush", self.flush_run),
+                ("merge_runs", lambda: self.merge_runs(parser, corpus_size, index_fn)),
+                ("load", lambda: self.load_index(index_fn)),
+            ]
+        else:
+            stages = [
+                # handle the case of capital letters according to partA rules.
+                ("capital_letters", lambda: self.handle_capital_letters(parser)),
+                ("idf", lambda: self.add_idf_to_inverted_index(corpus_size)),
+                # build dict of {doc_id : sqrt(w_ij^2) ...}
+                ("weight_of_docs", self.build_weight_of_docs),
+                ("remove_rare_terms", self.remove_all_the_term_with_1_appearance),
+                ("sort", self.sort_index),
+            ]
+            if self.impact_ordered_postings:
+                stages.append(("impact_order", self.calculate_impact_orders))
+        self._run_stages(stages)
+
+    def finalize_shard(self, upper_case_dict, global_inverted_idx):
+        """
+        finalize the index of a shard of the corpus with the statistics of all the corpus, so the shard has the
+        terms, idf and weight of docs that its docs have in the index of all the corpus.
+        :param upper_case_dict: upper case dictionary of the corpus, after the capital letters of the corpus
+                                were handled (only the words that are saved in capital letters are left)
+        :param global_inverted_idx: {term : (df, idf)} of all the corpus in the order of the terms of its index,
+                                    before the terms that appear once are removed
+        :return:
+        """
+        self.stage_times = collections.OrderedDict()
+        stages = [
+            ("capital_letters", lambda: self.handle_capital_letters_of_shard(upper_case_dict)),
+            ("idf", lambda: self.set_global_idf(global_inverted_idx)),
+            ("weight_of_docs", self.build_weight_of_docs),
+            ("remove_rare_terms", self.remove_all_the_term_with_1_appearance),
+            ("sort", self.sort_index),
+        ]
+        if self.impact_ordered_postings:
+            stages.append(("impact_order", self.calculate_impact_orders))
+        self._run_stages(stages)
+
+    def _run_stages(self, stages):
+        """
+        run the stages of finalize and save the wall time of every stage in stage_times.
+        :param stages: list of (stage name, function)
+        :return:
+        """
+        for stage_name, stage in stages:
+            start = time.time()
+            stage()
+            self.stage_times[stage_name] = time.time() - start
+            logging.debug("indexer stage {} took {:.3f} seconds".format(stage_name, self.stage_times[stage_name]))
+        self.generation += 1
+
+    def handle_capital_letters_of_shard(self, upper_case_dict):
+        """
+        save in capital letters the words that the corpus saves in capital letters. in the index of the corpus
+        the postings of such word replace the postings of the word in capital letters, so the postings of the
+        word in capital letters are removed from the shard even if the shard doesn't have the word.
+        :param upper_case_dict: {word : True} of the words that are saved in capital letters
+        :return:
+        """
+        for word in upper_case_dict:
+            upper_word = word.upper()
+            if upper_word != word and upper_word in self.inverted_idx:
+                self.inverted_idx.pop(upper_word)
+                self.postingDict.pop(upper_word)
+            if word in self.inverted_idx:
+                self.inverted_idx[upper_word] = self.inverted_idx.pop(word)
+                self.postingDict[upper_word] = self.postingDict.pop(word)
+
+    def set_global_idf(self, global_inverted_idx):
+        """
+        give the terms of the shard the df and idf of the corpus, and keep them in the order of the terms of the
+        corpus index, so the weight of every doc is summed in the same order as in the index of the corpus.
+        :param global_inverted_idx: {term : (df, idf)} of all the corpus
+        :return:
+        """
+        self.inverted_idx = collections.OrderedDict(
+            (term, global_inverted_idx[term]) for term in global_inverted_idx if term in self.inverted_idx)
+        self.postingDict = collections.OrderedDict((term, self.postingDict[term]) for term in self.inverted_idx)
+
+    def sort_index(self):
+        """
+        sort the inverted index and posting dicts in alphabet order
+        :return:
+        """
+        self.inverted_idx = collections.OrderedDict(sorted(self.inverted_idx.items()))
+        self.postingDict = collections.OrderedDict(sorted(self.postingDict.items()))
+
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
     def load_index(self, fn):
         """
         Loads a pre-computed index (or indices) so we can answer queries.
         Input:
-            fn - file name of pickled index.
+            fn - file name of pickled index, or the prefix of the binary index files.
+        """
+        # save_index('idx_bench.pkl') and save_index('idx_bench') both write idx_bench.lex, .post and .docs
+        prefix = disk_index.index_prefix(fn)
+        if os.path.exists(prefix + '.lex'):
+            # binary index, the files are opened with mmap and read lazily.
+            self.inverted_idx = disk_index.DiskLexicon(prefix + '.lex')
+            self.doc_ids, self.doc_dates, self.weight_of_docs, self.doc_unique_terms = \
+                disk_index.read_doc_table(prefix + '.docs')
+            self.postingDict = disk_index.DiskPostings(prefix + '.post', self.inverted_idx, self.doc_unique_terms)
+            self.impact_orders = disk_index.DiskImpactOrders(self.inverted_idx, self.postingDict)
+        else:
+            loaded_index = utils.load_obj(fn)
+            if len(loaded_index) == 2:
+                # index from older version: (inverted_idx, {term : [[tweet_id, freq, tf, date, tf-idf] ...]})
+                self.load_posting_lists_index(*loaded_index)
+            else:
+                self.inverted_idx, self.postingDict, doc_table = loaded_index
+                self.doc_ids, self.doc_dates, self.doc_unique_terms, self.weight_of_docs = doc_table
+            self.impact_orders = {}
+        # the spelling corrector that was saved with the index, if there is one, is opened on first use.
+        self.spelling_corrector = None
+        self.spelling_corrector_path = prefix + '.spell' if os.path.exists(prefix + '.spell') else None
+        self.generation += 1
+        return self.inverted_idx, self.postingDict
+
+    def load_posting_lists_index(self, inverted_idx, posting_lists_dict):
+        """
+        convert index that saved the postings as lists of [tweet_id, freq, tf, date, tf-idf] to posting arrays.
+        :param inverted_idx: {term : (df, idf)}
+        :param posting_lists_dict: {term : [[tweet_id, freq, tf, date, tf-idf] ...]}
+        :return:
         """
-        return utils.load_obj(fn)
+        self.inverted_idx = inverted_idx
+        self.postingDict = collections.OrderedDict()
+        self.doc_ids = array('q')
+        self.doc_dates = array('q')
+        self.doc_unique_terms = array('H')
+        segma_w_ij_pow_of_docs = []
+        tweet_id_to_ordinal = {}
+        for term, posting_lists in posting_lists_dict.items():
+            postings = []
+            for tweet_id, freq, tf, date, tf_idf in posting_lists:
+                if tweet_id not in tweet_id_to_ordinal:
+                    tweet_id_to_ordinal[tweet_id] = len(self.doc_ids)
+                    self.doc_ids.append(int(tweet_id))
+                    self.doc_dates.append(self.date_to_int(date))
+                    # tf = freq / number of unique terms in the doc
+                    self.doc_unique_terms.append(round(freq / tf))
+                    segma_w_ij_pow_of_docs.append(0.0)
+                doc_ordinal = tweet_id_to_ordinal[tweet_id]
+                segma_w_ij_pow_of_docs[doc_ordinal] += math.pow(tf_idf, 2)
+                postings.append((doc_ordinal, freq, tf))
+            # keep the postings of every term sorted by doc ordinal
+            postings.sort()
+            posting_list = PostingList()
+            for doc_ordinal, freq, tf in postings:
+                posting_list.append(doc_ordinal, freq, tf)
+            self.postingDict[term] = posting_list
+        # the norms are calculated from the postings that kept in the index.
+        self.weight_of_docs = array('d', map(math.sqrt, segma_w_ij_pow_of_docs))
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
     def save_index(self, fn):
         """
         Saves a pre-computed index (or indices) so we can save our work.
+        the index is saved as binary files <fn>.lex, <fn>.post and <fn>.docs that load_index opens with mmap,
+        and the spelling corrector of the index is saved to <fn>.spell.
         Input:
-              fn - file name of pickled index.
+              fn - prefix of the index files (a trailing .pkl is dropped).
         """
-        utils.save_obj((self.inverted_idx, self.postingDict), fn)
+        fn = disk_index.index_prefix(fn)
+        # the weights that are calculated in the background are saved, not the weights before the last append.
+        self.wait_for_weight_of_docs()
+        impact_orders = None
+        if self.impact_ordered_postings:
+            impact_orders = {term: self.get_term_impact_order(term) for term in self.inverted_idx}
+        disk_index.write_index(fn, self.inverted_idx, self.postingDict, self.doc_ids, self.doc_dates,
+                               self.weight_of_docs, self.doc_unique_terms, impact_orders)
+        self.get_spelling_corrector().save(fn + '.spell')
 
     # feel free to change the signature and/or implementation of this function 
     # or drop altogether.
@@ -140,7 +732,7 @@ class Indexer:
         """
         Return the posting list from the index for a term.
         """
-        return self.postingDict[term] if self._is_term_exist(term) else []
+        return self.postingDict[term] if self._is_term_exist(term) else PostingList()
 
     def remove_all_the_term_with_1_appearance(self):
         """
@@ -2,9 +2,195 @@ from nltk.corpus import stopwords
 # from nltk.tokenize import word_tokenize
 from nltk.tokenize import RegexpTokenizer
 from document import Document
+from reader import date_string_to_int
 
-from stemmer import Stemmer
+from stemmer import Stemmer, stem
+import copy
 import re
+from array import array
+from functools import lru_cache
+
+# tokens are split with spaces. str.split is much faster than the tokenizer, and it splits on the same characters
+# except the information separators \x1c-\x1f, the tweets that have them are split by the tokenizer.
+_SPACES_TOKENIZER = RegexpTokenizer(r'\s+', gaps=True)
+_INFORMATION_SEPARATORS = re.compile('[\x1c-\x1f]')
+# patterns of the rules, compiled once.
+_URL_PATTERN = re.compile(r'(https?)?(?:://)?(www)?\.?(\w+\.\w+(?:\.\w+)*)')
+_NUMBER_PATTERN = re.compile(r'^\d+(\,\d+)*(\.\d+)?$')
+_DOLLAR_PATTERN = re.compile(
+    r'\$\d+$|\d+\$$|\$\d+\.\d+$|\d+\.\d+\$$|\$\d+(\,\d+)*(\.\d)?(\d+)?$|\d+(\,\d+)*(\.\d)?(\d+)?\$$')
+# number that ends with k/m/b, like 10k or 1.5m
+_NUMBER_WITH_UNIT_PATTERN = re.compile(r'\d+(?:\.\d+)?[kmb]$')
+_ROUNDED_NUMBER_PATTERN = re.compile(r'\d+.\d{0,3}')
+
+
+# the rules below depend on the term only and not on the state of the parser. the same hashtags, urls and numbers
+# appear in many tweets, so the results of the rules are kept in bounded lru caches.
+RULE_CACHE_SIZE = 2 ** 16
+
+
+@lru_cache(maxsize=RULE_CACHE_SIZE)
+def transform_number(num):
+    """
+    this function will get a number and short it according to the rules.
+    :param num: number in float
+    :return: shorted number
+    """
+    num_to_add = ""
+
+    if num < 0.001:
+        num = 0.0
+    # if the number divide by thousand
+    if num/1000 >= 1:
+        num = num/1000
+        # if the number divide by million
+        if num / 1000 >= 1:
+            num = num / 1000
+            # if the number divide by billion
+            if num / 1000 >= 1:
+                num = num / 1000
+                num_as_str = str(num)
+                if "e" in num_as_str:
+                    list_of_big_num = num_as_str.split("e+")
+                    num_as_str = list_of_big_num[0] + "0"*int(list_of_big_num[1])
+                # round to 3 digits after dot.
+                num_to_add = float(_ROUNDED_NUMBER_PATTERN.match(num_as_str).group(0))
+                # check the type of num_to_add
+                if not num_to_add.is_integer():
+                    num_to_add = str(num_to_add) + "B"
+                else:
+                    num_to_add = str(int(num_to_add)) + "B"
+
+            # divided by million but not billion
+            else:
+                num_to_add = float(_ROUNDED_NUMBER_PATTERN.match(str(num)).group(0))
+                if not num_to_add.is_integer():
+                    num_to_add = str(num_to_add) + "M"
+                else:
+                    num_to_add = str(int(num_to_add)) + "M"
+        # divided by thousand but not million
+        else:
+            num_to_add = float(_ROUNDED_NUMBER_PATTERN.match(str(num)).group(0))
+            if not num_to_add.is_integer():
+                num_to_add = str(num_to_add) + "K"
+            else:
+                num_to_add = str(int(num_to_add))+"K"
+    # not divided by thousand
+    else:
+        num_to_add = float(_ROUNDED_NUMBER_PATTERN.match(str(num)).group(0))
+        if not num_to_add.is_integer():
+            num_to_add = str(num_to_add)
+        else:
+            num_to_add = str(int(num_to_add))
+
+    return num_to_add
+
+
+@lru_cache(maxsize=RULE_CACHE_SIZE)
+def url_terms(term):
+    """
+    split urls to terms according to the rules.
+    :param term: full url
+    :return: tuple of terms
+    """
+    list_of_new_terms = []
+    # short url cut after domain.
+    pattern = _URL_PATTERN.match(term)
+    # catch the number of the sub groups
+    group_number = len(pattern.groups())
+
+    # loop over each sub group and add it to list_of_new_terms if not none
+    for i in range(1, group_number+1):
+        curr_group = pattern.group(i)
+        if curr_group is not None and i == group_number:
+            list_of_new_terms.append(curr_group.lower())
+            return tuple(list_of_new_terms)
+
+    """
+    the following code, add to the list all the parts of the url.
+    if we want the all parts, uncomment the code and remove the return from above,
+    and the after and term.
+    """
+    # # catch the short url and cut it from the full url.
+    # matched_url = pattern.group(0)
+    # new_term = term[len(matched_url):]
+    #
+    # # loop over the rest of the url and add it to list_of_new_terms, ignoring no digit or no letter chars.
+    # start_index_curr_term = 0
+    # for idx, charr in enumerate(new_term + " "):
+    #     if not charr.isalpha() and not charr.isdigit():
+    #         if start_index_curr_term == idx:
+    #             start_index_curr_term += 1
+    #         else:
+    #             list_of_new_terms.append(new_term[start_index_curr_term:idx])
+    #             start_index_curr_term = idx+1
+    #
+    # return list_of_new_terms
+
+
+@lru_cache(maxsize=RULE_CACHE_SIZE)
+def split_hashtags(term):
+    """
+    the function split the hashtag according to the rules.
+    :param term: full hashtag term
+    :return: tuple of new terms splited
+    """
+    # initalize a set and add to it the term without "_"
+    set_of_new_terms = set()
+    set_of_new_terms.add(term[1:].replace("_", "").lower())
+    # save the term without the '#' sign and initalize vars
+    new_term = term[1:]
+    term_to_add = ""
+
+    # if the term look like "#word_word_word"
+    if '_' in new_term:
+        while True:
+            # save the index that the sign "_" appear for the first time
+            i = new_term.find('_')
+
+            # if we don't find "_" anymore, add to the list and stop the loop
+            if i == -1:
+                set_of_new_terms.add(new_term)
+                break
+
+            # cut the term to sub terms. add sub term to list.
+            term_to_add = new_term[:i].lower()
+            new_term = new_term[i+1:]
+            if len(term_to_add) > 0:
+                set_of_new_terms.add(term_to_add)
+
+        # add to set without "_"
+        set_of_new_terms.add(term[1:].lower().replace("_", ""))
+        set_of_new_terms.add(term.lower().replace("_", ""))
+    # if the hashtag look like "#wordWordWord"
+    else:
+        # loop over the term without "#" and split according to capital letters
+        idx = 0
+        for letter in term[1:]:
+            if letter.isupper() and idx > 0:
+                term_to_add = new_term[:idx].lower()
+                if len(term_to_add) > 1:
+                    set_of_new_terms.add(term_to_add)
+                new_term = new_term[idx:]
+                idx = 1
+            else:
+                idx += 1
+
+        # add the last term to the set
+        set_of_new_terms.add(new_term.lower())
+
+        # catch all the sub terms that separeted by "-" and add to the set
+        splited_terms = term[1:].split("-")
+        for subterm in splited_terms:
+            if len(splited_terms) > 1 and len(subterm) > 0:
+                set_of_new_terms.add(subterm.lower())
+
+        # add to set without "-"
+        set_of_new_terms.add(term[1:].lower().replace("-", ""))
+        set_of_new_terms.add(term.lower().replace("-", ""))
+
+    # the cached result is a tuple in the order of the set, so it can not be changed by the callers.
+    return tuple(set_of_new_terms)
 
 
 class Parse:
@@ -14,7 +200,7 @@ class Parse:
         self.our_stop_words = [".", "y'all", "didn't", "here's", "don't", "would", "oh", "etc", "i'd",
                                "can't", "wouldn't", "that's", "via", "let's", "i've", "he's", "it'll", "aka",
                                "we've", "due", "i'm", "rt", "tr"]
-        self.stop_words = stopwords.words('english') + self.our_stop_words
+        self.stop_words = frozenset(stopwords.words('english') + self.our_stop_words)
         # dictionary to mark all the words suspected to save with upper, for all the corpus.
         # true means we didnt see this word with lower case. else false.
         self.upper_case_dict = {}
@@ -27,26 +213,31 @@ class Parse:
         self.term_of_entitie = ""
         # save all the entities for the current tweet.
         self.tweet_entities = []
-        # list for all punctuation that we want to remove
-        self.punctuation = [".", ",", "-", "_", ":", ";", "!", "?", "(", ")", "[", "]", "{", "}", "'", '"',
-                            "&", "~", "/", "=", "+", "|", "^", "*", "<", ">", "`"]
+        # all the punctuation that we want to remove
+        self.punctuation = frozenset([".", ",", "-", "_", ":", ";", "!", "?", "(", ")", "[", "]", "{", "}", "'", '"',
+                                      "&", "~", "/", "=", "+", "|", "^", "*", "<", ">", "`"])
         self.with_stemmer = with_stemmer
         self.stemmer = Stemmer()
-        # dict of months to change the date in the documents.
-        self.month_dict = {
-                    'Jan': "01",
-                    'Feb': "02",
-                    'Mar': "03",
-                    'Apr': "04",
-                    'May': "05",
-                    'Jun': "06",
-                    'Jul': "07",
-                    'Aug': "08",
-                    'Sep': "09",
-                    'Oct': "10",
-                    'Nov': "11",
-                    'Dec': "12"
-                }
+
+    def merge_corpus_state(self, upper_case_dict, names_and_entities):
+        """
+        merge the corpus state that other parser collected (for example in a worker process) into this parser.
+        a word stays upper case only if no parser saw it with lower case, and the entities counters are summed,
+        so the merged state is the same as parsing all the tweets with one parser.
+        :param upper_case_dict: upper case dictionary of the other parser
+        :param names_and_entities: names and entities dictionary of the other parser
+        :return:
+        """
+        for word, only_upper_case in upper_case_dict.items():
+            if word in self.upper_case_dict:
+                self.upper_case_dict[word] = self.upper_case_dict[word] and only_upper_case
+            else:
+                self.upper_case_dict[word] = only_upper_case
+        for entitie, number_of_tweets in names_and_entities.items():
+            if entitie in self.names_and_entities:
+                self.names_and_entities[entitie] += number_of_tweets
+            else:
+                self.names_and_entities[entitie] = number_of_tweets
 
     def parse_sentence(self, text):
         """
@@ -54,22 +245,28 @@ class Parse:
         :param text:
         :return:
         """
-        t = RegexpTokenizer('\s+', gaps=True)  # split with spaces.
-
-        text_tokens = t.tokenize(text)
+        if _INFORMATION_SEPARATORS.search(text) is None:
+            text_tokens = text.split()
+        else:
+            text_tokens = _SPACES_TOKENIZER.tokenize(text)
+        punctuation = self.punctuation
         text_tokens_without_stopwords = []  # the list that we will return to search_engine
         for term in text_tokens:
-            while len(term) > 0 and (term[0] in self.punctuation or not term[0].isascii()):
-                term = term[1:]
-
-            if len(term) > 0 and (term[-1] in self.punctuation or not term[-1].isascii()):
-                while len(term) > 0 and (term[-1] in self.punctuation or not term[-1].isascii()):
-                    term = term[:-1]
-                terms_after_rules = self.rule_checking(term)
+            # remove the punctuation and the non ascii characters from the edges of the term, the term is cut once.
+            start = 0
+            end = len(term)
+            while start < end and (term[start] in punctuation or term[start] > '\x7f'):
+                start += 1
+
+            if start < end and (term[end - 1] in punctuation or term[end - 1] > '\x7f'):
+                end -= 1
+                while term[end - 1] in punctuation or term[end - 1] > '\x7f':
+                    end -= 1
+                terms_after_rules = self.rule_checking(term[start:end])
                 terms_after_rules += self.rule_checking(".")
 
             else:
-                terms_after_rules = self.rule_checking(term)  # send to funcation that check all parser rules
+                terms_after_rules = self.rule_checking(term[start:end])  # send to funcation that check all parser rules
 
             text_tokens_without_stopwords.extend(terms_after_rules)
         if len(self.term_of_num) > 0 or len(self.term_of_entitie) > 0:
@@ -88,6 +285,24 @@ class Parse:
 
         return text_tokens_without_stopwords
 
+    def parse_query(self, text):
+        """
+        parse a query to the same terms that parse_sentence gives, without changing the parser.
+        parse_sentence saves the state of the current tweet in the parser and adds to the corpus dictionaries,
+        so the query is parsed by a copy of the parser with its own state, and many threads can parse
+        queries with the same parser.
+        :param text: the query
+        :return: list of terms
+        """
+        query_parser = copy.copy(self)
+        # the corpus dictionaries of the copy are thrown away with it.
+        query_parser.upper_case_dict = {}
+        query_parser.names_and_entities = {}
+        query_parser.term_of_num = ""
+        query_parser.term_of_entitie = ""
+        query_parser.tweet_entities = []
+        return query_parser.parse_sentence(text)
+
     def rule_checking(self, term):
         """
         in this function we check all the rules for single term
@@ -96,8 +311,6 @@ class Parse:
         """
         text_tokens_without_stopwords = []
         term_lower = term.lower()
-        # find patterns of urls and term with number'$' or '$'number
-        pattern_url = re.match(r'(https?)?(?:://)?(www)?\.?(\w+\.\w+(?:\.\w+)*)', term)
 
         # check if the term isn't a stop_word then we'll parse it.
         if term_lower not in self.stop_words and (len(term_lower) > 1 or term_lower.isdigit()) and term_lower.isascii():
@@ -125,11 +338,11 @@ class Parse:
             elif term[0].isdigit() or term[0] == "$":
                 # check if all the term is numeric
                 if term.replace('.', '', 1).replace(',', '').isdigit():
-                    if re.match(r'^\d+(\,\d+)*(\.\d+)?$', term) is not None:
+                    if _NUMBER_PATTERN.match(term) is not None:
                         self.term_of_num = term.replace(',', '')  # remove commas and save the number for next iteration.
                     else:
                         text_tokens_without_stopwords.append(term_lower)
-                elif re.match(r'\$\d+$|\d+\$$|\$\d+\.\d+$|\d+\.\d+\$$|\$\d+(\,\d+)*(\.\d)?(\d+)?$|\d+(\,\d+)*(\.\d)?(\d+)?\$$', term) is not None:
+                elif _DOLLAR_PATTERN.match(term) is not None:
                     term = term.replace('$', '').replace(',', '')  # transform the term to numbers only
                     string_of_dollar = self.transform_number(float(term))  # transform the number according to rules.
                     string_of_dollar += "$"
@@ -163,9 +376,9 @@ class Parse:
                     hashtag_list = self.split_hashtags(term)  # function that split the hashtag accrding to the rules.
                     text_tokens_without_stopwords.extend(hashtag_list)
 
-            # if url was found
-            elif pattern_url is not None:
-                list_of_url = self.url_handler(pattern_url, term)  # send to function that split the url.
+            # if url was found (patterns of urls)
+            elif _URL_PATTERN.match(term) is not None:
+                list_of_url = self.url_handler(term)  # send to function that split the url.
                 text_tokens_without_stopwords.extend(list_of_url)
 
             elif "/" in term:
@@ -207,10 +420,6 @@ class Parse:
         :return: list of terms
         """
         list_of_terms = []
-        # catch patterns of numbers that end with k/m/b
-        pattern_k = re.match(r'\d+\.\d+k$|\d+k$',term_lower)
-        pattern_m = re.match(r'\d+\.\d+m$|\d+m$',term_lower)
-        pattern_b = re.match(r'\d+\.\d+b$|\d+b$',term_lower)
 
         # handle case "number %" or "number percent(age)"
         if term_lower == "%" or term_lower.startswith("percent"):
@@ -245,8 +454,8 @@ class Parse:
                 num_term += " "+term.replace('\\', '/')
                 list_of_terms.append(num_term)
 
-        # if one of the patterns not none "number k/m/b" without space
-        elif pattern_k is not None or pattern_m is not None or pattern_b is not None:
+        # catch patterns of numbers that end with k/m/b, "number k/m/b" without space
+        elif _NUMBER_WITH_UNIT_PATTERN.match(term_lower) is not None:
             list_of_terms.append(term.upper())
 
         # if the term is not one of the special cases above
@@ -270,93 +479,15 @@ class Parse:
         :param num: number in float
         :return: shorted number
         """
-        num_to_add = ""
-
-        if num < 0.001:
-            num = 0.0
-        # if the number divide by thousand
-        if num/1000 >= 1:
-            num = num/1000
-            # if the number divide by million
-            if num / 1000 >= 1:
-                num = num / 1000
-                # if the number divide by billion
-                if num / 1000 >= 1:
-                    num = num / 1000
-                    num_as_str = str(num)
-                    if "e" in num_as_str:
-                        list_of_big_num = num_as_str.split("e+")
-                        num_as_str = list_of_big_num[0] + "0"*int(list_of_big_num[1])
-                    # round to 3 digits after dot.
-                    num_to_add = float(re.match(r'\d+.\d{0,3}', num_as_str).group(0))
-                    # check the type of num_to_add
-                    if not num_to_add.is_integer():
-                        num_to_add = str(num_to_add) + "B"
-                    else:
-                        num_to_add = str(int(num_to_add)) + "B"
-
-                # divided by million but not billion
-                else:
-                    num_to_add = float(re.match(r'\d+.\d{0,3}', str(num)).group(0))
-                    if not num_to_add.is_integer():
-                        num_to_add = str(num_to_add) + "M"
-                    else:
-                        num_to_add = str(int(num_to_add)) + "M"
-            # divided by thousand but not million
-            else:
-                num_to_add = float(re.match(r'\d+.\d{0,3}', str(num)).group(0))
-                if not num_to_add.is_integer():
-                    num_to_add = str(num_to_add) + "K"
-                else:
-                    num_to_add = str(int(num_to_add))+"K"
-        # not divided by thousand
-        else:
-            num_to_add = float(re.match(r'\d+.\d{0,3}', str(num)).group(0))
-            if not num_to_add.is_integer():
-                num_to_add = str(num_to_add)
-            else:
-                num_to_add = str(int(num_to_add))
-
-        return num_to_add
+        return transform_number(num)
 
-    def url_handler(self, pattern, term):
+    def url_handler(self, term):
         """
         split urls to terms according to the rules.
-        :param pattern: short url cut after domain.
         :param term: full url
-        :return: list of terms
-        """
-        list_of_new_terms = []
-        # catch the number of the sub groups
-        group_number = len(pattern.groups())
-
-        # loop over each sub group and add it to list_of_new_terms if not none
-        for i in range(1, group_number+1):
-            curr_group = pattern.group(i)
-            if curr_group is not None and i == group_number:
-                list_of_new_terms.append(curr_group.lower())
-                return list_of_new_terms
-
+        :return: tuple of terms
         """
-        the following code, add to the list all the parts of the url.
-        if we want the all parts, uncomment the code and remove the return from above,
-        and the after and term.
-        """
-        # # catch the short url and cut it from the full url.
-        # matched_url = pattern.group(0)
-        # new_term = term[len(matched_url):]
-        #
-        # # loop over the rest of the url and add it to list_of_new_terms, ignoring no digit or no letter chars.
-        # start_index_curr_term = 0
-        # for idx, charr in enumerate(new_term + " "):
-        #     if not charr.isalpha() and not charr.isdigit():
-        #         if start_index_curr_term == idx:
-        #             start_index_curr_term += 1
-        #         else:
-        #             list_of_new_terms.append(new_term[start_index_curr_term:idx])
-        #             start_index_curr_term = idx+1
-        #
-        # return list_of_new_terms
+        return url_terms(term)
 
     def handle_entitie(self):
         """
@@ -404,99 +535,52 @@ class Parse:
         """
         the function split the hashtag according to the rules.
         :param term: full hashtag term
-        :return: list of new terms splited
+        :return: tuple of new terms splited
         """
-        # initalize a set and add to it the term without "_"
-        set_of_new_terms = set()
-        set_of_new_terms.add(term[1:].replace("_", "").lower())
-        # save the term without the '#' sign and initalize vars
-        new_term = term[1:]
-        term_to_add = ""
-
-        # if the term look like "#word_word_word"
-        if '_' in new_term:
-            while True:
-                # save the index that the sign "_" appear for the first time
-                i = new_term.find('_')
-
-                # if we don't find "_" anymore, add to the list and stop the loop
-                if i == -1:
-                    set_of_new_terms.add(new_term)
-                    break
-
-                # cut the term to sub terms. add sub term to list.
-                term_to_add = new_term[:i].lower()
-                new_term = new_term[i+1:]
-                if len(term_to_add) > 0:
-                    set_of_new_terms.add(term_to_add)
+        return split_hashtags(term)
 
-            # add to set without "_"
-            set_of_new_terms.add(term[1:].lower().replace("_", ""))
-            set_of_new_terms.add(term.lower().replace("_", ""))
-        # if the hashtag look like "#wordWordWord"
-        else:
-            # loop over the term without "#" and split according to capital letters
-            idx = 0
-            for letter in term[1:]:
-                if letter.isupper() and idx > 0:
-                    term_to_add = new_term[:idx].lower()
-                    if len(term_to_add) > 1:
-                        set_of_new_terms.add(term_to_add)
-                    new_term = new_term[idx:]
-                    idx = 1
-                else:
-                    idx += 1
-
-            # add the last term to the set
-            set_of_new_terms.add(new_term.lower())
-
-            # catch all the sub terms that separeted by "-" and add to the set
-            splited_terms = term[1:].split("-")
-            for subterm in splited_terms:
-                if len(splited_terms) > 1 and len(subterm) > 0:
-                    set_of_new_terms.add(subterm.lower())
-
-            # add to set without "-"
-            set_of_new_terms.add(term[1:].lower().replace("-", ""))
-            set_of_new_terms.add(term.lower().replace("-", ""))
-
-        return set_of_new_terms
+    @staticmethod
+    def cache_info():
+        """
+        hits, misses and size of the caches of the rules, shared by all the parsers of the process.
+        :return: {rule name : CacheInfo}
+        """
+        return {'transform_number': transform_number.cache_info(),
+                'url_handler': url_terms.cache_info(),
+                'split_hashtags': split_hashtags.cache_info(),
+                'stem_term': stem.cache_info()}
 
-    def parse_doc(self, doc_as_list):
+    def parse_doc(self, doc_as_list, keep_text=False):
         """
         This function takes a tweet document as list and break it into different fields
-        :param doc_as_list: list re-preseting the tweet.
+        :param doc_as_list: list re-preseting the tweet, [tweet_id, tweet_date, full_text ...].
+                            the reader normalizes the id and the date to ints, the rows of the full file
+                            (ReadFile.read_file) still have them as strings.
+        :param keep_text: keep the full text of the tweet in the document.
         :return: Document object with corresponding fields.
         """
-        tweet_id = doc_as_list[0]
+        tweet_id = int(doc_as_list[0])
         tweet_date = doc_as_list[1]
-        # change the date to format "year/month/day hour"
-        splited_tweet_date = tweet_date.split(" ")
-        tweet_date = splited_tweet_date[5]+"/"+self.month_dict[splited_tweet_date[1]]+"/"+splited_tweet_date[2]+" "+splited_tweet_date[3]
+        if isinstance(tweet_date, str):
+            tweet_date = date_string_to_int(tweet_date)
 
         full_text = doc_as_list[2]
-        url = doc_as_list[3]
-        retweet_text = doc_as_list[4]
-        retweet_url = doc_as_list[5]
-        quote_text = doc_as_list[6]
-        quote_url = doc_as_list[7]
         term_dict = {}
         tokenized_text = self.parse_sentence(full_text)
         doc_length = len(tokenized_text)  # after text operations.
 
-        for idx, term in enumerate(tokenized_text):
-            if term not in term_dict.keys():
-                term_dict[term] = 1
-            else:
-                term_dict[term] += 1
+        for term in tokenized_text:
+            term_dict[term] = term_dict.get(term, 0) + 1
 
         unique_words = len(term_dict)
+        # the terms and their frequencies are kept as parallel arrays, not as a dict per doc.
+        freqs = array('H', term_dict.values())
 
         if unique_words == 0:
             tf_max = 0
         else:
-            tf_max = max(term_dict.values())
+            tf_max = max(freqs)
 
-        document = Document(tweet_id, tweet_date, full_text, url, retweet_text, retweet_url, quote_text,
-                            quote_url, term_dict, doc_length, tf_max, unique_words)
+        document = Document(tweet_id, tweet_date, tuple(term_dict), freqs, doc_length, tf_max, unique_words,
+                            full_text if keep_text else None)
         return document
@@ -0,0 +1,37 @@
+from array import array
+
+
+class PostingList:
+    """
+    posting list of a single term, saved as parallel compact arrays instead of a list per posting.
+    the i-th posting is (docs[i], freqs[i], weights[i]).
+    """
+    __slots__ = ('docs', 'freqs', 'weights')
+
+    def __init__(self, docs=None, freqs=None, weights=None):
+        """
+        :param docs: int32 doc ordinals (index to the per-doc table of the indexer)
+        :param freqs: uint16 frequency of the term in the doc
+        :param weights: float32 weight of the term in the doc (tf, the idf is multiplied at query time)
+        """
+        self.docs = docs if docs is not None else array('i')
+        self.freqs = freqs if freqs is not None else array('H')
+        self.weights = weights if weights is not None else array('f')
+
+    def append(self, doc, freq, weight):
+        """
+        add a posting to the end of the list.
+        :param doc: doc ordinal
+        :param freq: frequency of the term in the doc
+        :param weight: weight of the term in the doc
+        :return:
+        """
+        self.docs.append(doc)
+        self.freqs.append(freq)
+        self.weights.append(weight)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return zip(self.docs, self.freqs, self.weights)
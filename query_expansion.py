@@ -0,0 +1,155 @@
+import os
+import disk_index
+import utils
+from nltk.corpus import lin_thesaurus as thes
+from nltk.corpus import wordnet
+
+# weights of the words that query expansion adds to the query.
+WORDNET_SYNONYM_WEIGHT = 0.5
+WORDNET_ANTONYM_WEIGHT = 0.4
+THESAURUS_WEIGHT = 0.4
+# part of speech tag of a query term : file of the lin thesaurus with the similar words of that part of speech.
+THESAURUS_FILE_OF_TAG = {"NN": "simN.lsp", "VB": "simV.lsp", "JJ": "simA.lsp"}
+WORDNET_TABLE_FILE = 'wordnet_expansion'
+THESAURUS_TABLE_FILE = 'thesaurus_expansion'
+
+
+def _index_form(word, inverted_idx):
+    """
+    :param word: word from wordNet or thesaurus
+    :param inverted_idx: {term : (df, idf)}
+    :return: the word as it is saved in the index, None if it is not in the index.
+    """
+    # if the word appear in capital letters in inverted index
+    if word.upper() in inverted_idx:
+        word = word.upper()
+    if word in inverted_idx:
+        return word
+    return None
+
+
+def wordnet_expansion_of_term(term, inverted_idx):
+    """
+    find the words that wordNet expansion adds to the query for the term: the first synonym and the first
+    antonym that are in the index.
+    :param term: term of the query
+    :param inverted_idx: {term : (df, idf)}
+    :return: list of (word, weight) in the order they are added to the query
+    """
+    expansion = []
+    syn = True
+    ant = True
+    for synset in wordnet.synsets(term):
+        for lemma in synset.lemmas():
+            # if we didn't get synonm to the term
+            if syn:
+                lemma_name = lemma.name()
+                # if the synonm word is not similar to the term.
+                if not lemma_name.startswith(term):
+                    lemma_name = _index_form(lemma_name, inverted_idx)
+                    if lemma_name is not None:
+                        expansion.append((lemma_name, WORDNET_SYNONYM_WEIGHT))
+                        syn = False
+            # get list of opposite words
+            lemma_antonyms = lemma.antonyms()
+            if ant and lemma_antonyms:
+                lemma_antonyms_name = _index_form(lemma_antonyms[0].name(), inverted_idx)
+                if lemma_antonyms_name is not None:
+                    expansion.append((lemma_antonyms_name, WORDNET_ANTONYM_WEIGHT))
+                    ant = False
+        # we want to add only 2 words for each term that we want to expand
+        if not ant and not syn:
+            break
+    return expansion
+
+
+def thesaurus_expansion_of_term(term, tag, inverted_idx):
+    """
+    find the words that thesaurus expansion adds to the query for the term: the first 2 similar words
+    of its part of speech, the ones that are in the index.
+    :param term: term of the query
+    :param tag: part of speech tag of the term in the query
+    :param inverted_idx: {term : (df, idf)}
+    :return: list of words
+    """
+    if tag not in THESAURUS_FILE_OF_TAG:
+        return []
+    list_from_thes = list(thes.synonyms(term, fileid=THESAURUS_FILE_OF_TAG[tag]))
+    if len(list_from_thes) <= 1:
+        return []
+    words_from_thes = [_index_form(word_from_thes, inverted_idx) for word_from_thes in list_from_thes[:2]]
+    return [word_from_thes for word_from_thes in words_from_thes if word_from_thes is not None]
+
+
+def build_wordnet_table(inverted_idx):
+    """
+    :param inverted_idx: {term : (df, idf)}
+    :return: {term : [(word, weight) ...]} for every term of the index that wordNet expands.
+    """
+    table = {}
+    for term in inverted_idx:
+        expansion = wordnet_expansion_of_term(term, inverted_idx)
+        if expansion:
+            table[term] = expansion
+    return table
+
+
+def build_thesaurus_table(inverted_idx):
+    """
+    the part of speech of a term depends on the query, so the words are saved for every part of speech.
+    :param inverted_idx: {term : (df, idf)}
+    :return: {term : {tag : [word ...]}} for every term of the index that the thesaurus expands.
+    """
+    table = {}
+    for term in inverted_idx:
+        for tag in THESAURUS_FILE_OF_TAG:
+            words_from_thes = thesaurus_expansion_of_term(term, tag, inverted_idx)
+            if words_from_thes:
+                table.setdefault(term, {})[tag] = words_from_thes
+    return table
+
+
+def lexicon_fingerprint(inverted_idx):
+    """
+    :param inverted_idx: {term : (df, idf)}
+    :return: hash of the sorted terms of the index, the tables of an index depend only on its terms.
+    """
+    if isinstance(inverted_idx, disk_index.DiskLexicon):
+        # the binary lexicon saved the fingerprint of its terms when it was written.
+        return inverted_idx.fingerprint
+    return disk_index.lexicon_fingerprint(sorted(inverted_idx))
+
+
+def model_of_index(model, inverted_idx):
+    """
+    the tables of a model are valid only for the terms they were built for, a new or appended index
+    can have other terms.
+    :param model: {'fingerprint': lexicon fingerprint, table name : table} or None
+    :param inverted_idx: {term : (df, idf)}
+    :return: the model if it was built for the terms of the index, else None (the searcher looks the words up live).
+    """
+    if model is None or model.get('fingerprint') != lexicon_fingerprint(inverted_idx):
+        return None
+    return model
+
+
+def load_or_build_table(model_dir, table_file, build_table, inverted_idx, fingerprint):
+    """
+    load an expansion table from the model dir. if it is missing or was built for another index (another
+    lexicon fingerprint), build it for the index and save it to the model dir.
+    :param model_dir: directory of the precomputed model
+    :param table_file: name of the table file (without .pkl)
+    :param build_table: function that builds the table from the inverted index
+    :param inverted_idx: {term : (df, idf)}
+    :param fingerprint: lexicon_fingerprint of inverted_idx
+    :return: the table
+    """
+    path = os.path.join(model_dir, table_file)
+    if os.path.exists(path + '.pkl'):
+        saved_fingerprint, table = utils.load_obj(path + '.pkl')
+        if saved_fingerprint == fingerprint:
+            return table
+    table = build_table(inverted_idx)
+    os.makedirs(model_dir, exist_ok=True)
+    utils.save_obj((fingerprint, table), path)
+    return table
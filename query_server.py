@@ -0,0 +1,227 @@
+import importlib
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import utils
+
+
+def _serve_queries(engine_module, index_fn, config, requests, results):
+    """
+    main function of a worker process: open the index and answer the requests until the stop request (None).
+    the binary index is opened with mmap, so the lexicon, the postings, the per-doc table and the spelling
+    corrector are the pages of the page cache that all the workers share, and not a copy per worker.
+    the model was built and saved with the index before the workers started, a worker only reads it.
+    :param engine_module: name of the search engine module (for example 'search_engine_best')
+    :param index_fn: prefix of the binary index files
+    :param config: ConfigClass or None
+    :param requests: connection that receives (request id, query, k)
+    :param results: connection that sends (request id, result, exception)
+    :return:
+    """
+    engine = None
+    startup_exception = None
+    try:
+        engine = importlib.import_module(engine_module).SearchEngine(config)
+        if os.path.exists(index_fn + '.model.pkl'):
+            # the query session of load_index checks the model against the fingerprint of the lexicon file.
+            engine._model = utils.load_obj(index_fn + '.model.pkl')
+        engine.load_index(index_fn)
+    except Exception as e:
+        # the requests are answered with the exception, so the clients don't wait forever.
+        startup_exception = e
+    for request in iter(requests.recv, None):
+        request_id, query, k = request
+        if startup_exception is not None:
+            results.send((request_id, None, startup_exception))
+            continue
+        try:
+            results.send((request_id, engine.search(query, k), None))
+        except Exception as e:
+            results.send((request_id, None, e))
+
+
+class _QueryWorker:
+    """
+    worker process of the server with its own request and result connections, so the server knows which
+    requests every worker holds.
+    """
+
+    def __init__(self, engine_module, index_fn, config):
+        requests_reader, self.requests = Pipe(duplex=False)
+        self.results, results_writer = Pipe(duplex=False)
+        self.process = Process(target=_serve_queries,
+                               args=(engine_module, index_fn, config, requests_reader, results_writer),
+                               daemon=True)
+        self.process.start()
+        # the ends of the worker are closed here, so they are closed when the worker exits.
+        requests_reader.close()
+        results_writer.close()
+        self.alive = True
+        # number of requests that were sent to the worker and not answered yet.
+        self.n_pending = 0
+
+
+class QueryServer:
+    """
+    answer search requests with a pool of worker processes that share one binary index.
+    the index is built (or loaded) once and saved as binary files, every worker opens the files with mmap
+    and every request is sent to the worker with the fewest pending requests, so the memory of the index
+    doesn't grow with the workers.
+    when a worker exits (killed, out of memory) its pending requests fail with RuntimeError, and the next
+    requests are sent to the other workers.
+    """
+
+    def __init__(self, index_fn, processes, engine_module='search_engine_best', config=None):
+        """
+        :param index_fn: prefix of the binary index files (Indexer.save_index of the built index), and of the
+                         model file <index_fn>.model.pkl if the engine uses a model
+        :param processes: number of worker processes
+        :param engine_module: name of the search engine module that the workers use
+        :param config: ConfigClass or None
+        """
+        # {request id : (Future, worker)} of the requests that were not answered yet.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._workers = [_QueryWorker(engine_module, index_fn, config) for _ in range(processes)]
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+
+    @classmethod
+    def from_engine(cls, engine, index_fn, processes, engine_module='search_engine_best', model_dir=None):
+        """
+        save the index of a search engine as binary files once and serve it. the spelling corrector is saved with
+        the index and the model is loaded (or built) here once, so the workers don't build anything.
+        :param engine: SearchEngine with a built index
+        :param index_fn: prefix of the binary index files to write
+        :param processes: number of worker processes
+        :param engine_module: name of the search engine module that the workers use
+        :param model_dir: directory of the precomputed model, None if the engine doesn't use one
+        :return: QueryServer
+        """
+        engine._indexer.save_index(index_fn)
+        if model_dir is not None:
+            engine.load_precomputed_model(model_dir)
+        if engine._model is not None:
+            utils.save_obj(engine._model, index_fn + '.model')
+        elif os.path.exists(index_fn + '.model.pkl'):
+            # the model of an index that was saved before under this name.
+            os.remove(index_fn + '.model.pkl')
+        return cls(index_fn, processes, engine_module, engine._config)
+
+    def _collect_results(self):
+        """
+        wait for the results and for the exit of the workers, until all the workers exited.
+        :return:
+        """
+        workers_of_results = {worker.results: worker for worker in self._workers}
+        workers_of_sentinels = {worker.process.sentinel: worker for worker in self._workers}
+        while len(workers_of_sentinels) > 0:
+            for ready in wait(list(workers_of_results) + list(workers_of_sentinels)):
+                if ready in workers_of_results:
+                    try:
+                        self._set_result(ready.recv())
+                    except EOFError:
+                        workers_of_results.pop(ready)
+                elif ready in workers_of_sentinels:
+                    worker = workers_of_sentinels.pop(ready)
+                    # the results that the worker sent before it exited are still in its connection.
+                    if worker.results in workers_of_results:
+                        self._drain_results(worker.results)
+                        workers_of_results.pop(worker.results)
+                    self._fail_pending_of_worker(worker)
+
+    def _drain_results(self, results):
+        try:
+            while results.poll():
+                self._set_result(results.recv())
+        except EOFError:
+            pass
+
+    def _set_result(self, response):
+        request_id, result, exception = response
+        with self._pending_lock:
+            future, worker = self._pending.pop(request_id)
+            worker.n_pending -= 1
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _fail_pending_of_worker(self, worker):
+        with self._pending_lock:
+            worker.alive = False
+            failed_request_ids = [request_id for request_id, (_, pending_worker) in self._pending.items()
+                                  if pending_worker is worker]
+            failed_futures = [self._pending.pop(request_id)[0] for request_id in failed_request_ids]
+            worker.n_pending = 0
+        for future in failed_futures:
+            future.set_exception(RuntimeError('query worker exited with code {} before it answered'
+                                              .format(worker.process.exitcode)))
+
+    def submit(self, query, k=None):
+        """
+        send a search request to the workers.
+        :param query: query string
+        :param k: number of top results to return, default to everything.
+        :return: Future of (number of relevant docs, list of tweet ids)
+        """
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._pending_lock:
+            alive_workers = [worker for worker in self._workers if worker.alive]
+            if len(alive_workers) == 0:
+                future.set_exception(RuntimeError('all the query workers exited'))
+                return future
+            worker = min(alive_workers, key=lambda alive_worker: alive_worker.n_pending)
+            try:
+                worker.requests.send((request_id, query, k))
+            except OSError as e:
+                # the worker exited and the collector didn't see it yet.
+                future.set_exception(RuntimeError('query worker exited: {}'.format(e)))
+                return future
+            self._pending[request_id] = (future, worker)
+            worker.n_pending += 1
+        return future
+
+    def search(self, query, k=None):
+        """
+        :param query: query string
+        :param k: number of top results to return, default to everything.
+        :return: (number of relevant docs, list of tweet ids), the result of SearchEngine.search
+        """
+        return self.submit(query, k).result()
+
+    def search_many(self, queries, k=None):
+        """
+        :param queries: iterable of query strings
+        :param k: number of top results to return for every query, default to everything.
+        :return: list of results in the order of the queries, the queries are answered by all the workers.
+        """
+        futures = [self.submit(query, k) for query in queries]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        stop the workers after they answer the requests that were sent.
+        :return:
+        """
+        with self._pending_lock:
+            for worker in self._workers:
+                if worker.alive:
+                    try:
+                        worker.requests.send(None)
+                    except OSError:
+                        pass
+        for worker in self._workers:
+            worker.process.join()
+        self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,33 +1,216 @@
+import heapq
 import math
+import time
+import numpy as np
+
+# number of postings that anytime search scores from a posting list before it checks the budget again.
+ANYTIME_BLOCK_SIZE = 1024
 
 # you can change whatever you want in this module, just make sure it doesn't
 # break the searcher module
 class Ranker:
     def __init__(self, indexer):
         self.indexer = indexer
-
+        # the score_docs methods return the stats of the query with its docs, and the posting lists that were
+        # already read for a batch of queries are passed to them, so a ranker can score queries of many threads.
+        # the stats are {'postings': number of postings of the query terms,
+        #                'skipped_postings': postings that the budget of anytime search skipped,
+        #                'exact': if the ranks are exact (all the postings were scored)}
 
     @staticmethod
     def rank_relevant_docs(relevant_docs, k=None):
         """
         This function provides rank for each relevant document and sorts them by their scores.
-        The current score considers solely the number of terms shared by the tweet (full_text) and query.
+        The docs are sorted by rank and then by date, from the highest to the lowest.
+        when k is smaller than the number of docs, only the top k docs are selected (argpartition) and sorted.
         :param k: number of most relevant docs to return, default to everything.
-        :param relevant_docs: dictionary of documents that contains at least one term from the query.
+        :param relevant_docs: (doc ordinals, ranks, dates) parallel arrays of the relevant docs.
         :return: sorted list of documents by score
         """
-        ranked_results = sorted(relevant_docs.items(), key=lambda item: item[1], reverse=True)
-        ranked_results_cut = []
+        doc_ordinals, ranks, dates = relevant_docs
         # clear all the low similarity retrieved docs to get higher precision.
-        for idx, doc_tuple in enumerate(ranked_results):
-            if doc_tuple[1][0] <= 0.1:
-                ranked_results_cut = ranked_results[:idx]
-                break
-        if len(ranked_results_cut) > 0:
-            ranked_results = ranked_results_cut
+        high_similarity = ranks > 0.1
+        if high_similarity.any():
+            doc_ordinals = doc_ordinals[high_similarity]
+            ranks = ranks[high_similarity]
+            dates = dates[high_similarity]
+        if k is not None and 0 < k < len(ranks):
+            # the rank of the k-th doc, all the docs with this rank are kept so the date decides between them.
+            kth_rank = -np.partition(-ranks, k - 1)[k - 1]
+            top = np.flatnonzero(ranks >= kth_rank)
+            doc_ordinals = doc_ordinals[top]
+            ranks = ranks[top]
+            dates = dates[top]
+        # the last key is the primary key of lexsort.
+        order = np.lexsort((-dates, -ranks))
         if k is not None:
-            ranked_results = ranked_results[:k]
-        return [d[0] for d in ranked_results]
+            order = order[:k]
+        return doc_ordinals[order].tolist()
+
+    def get_term_posting_list(self, term, shared_posting_lists=None):
+        """
+        :param term: term of the query
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: PostingList of the term, from the shared posting lists of the batch if it is there.
+        """
+        if shared_posting_lists is not None and term in shared_posting_lists:
+            return shared_posting_lists[term]
+        return self.indexer.get_term_posting_list(term)
+
+    def score_docs(self, query_term_weights_dict, query_len_before_expension, shared_posting_lists=None):
+        """
+        score all the docs of the query terms, term at a time: the inner product of every doc is accumulated
+        in a dense array indexed by doc ordinal, one posting list at a time.
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param query_len_before_expension: number of query terms before expension
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: ((doc ordinals, ranks, dates) parallel arrays of the relevant docs, query stats)
+        """
+        inner_products, n_terms_in_docs, n_postings = self._accumulate_scores(query_term_weights_dict,
+                                                                              shared_posting_lists)
+        stats = {'postings': n_postings, 'skipped_postings': 0, 'exact': True}
+        return self._relevant_docs_of_scores(np.flatnonzero(n_terms_in_docs), inner_products, n_terms_in_docs,
+                                             query_term_weights_dict, query_len_before_expension), stats
+
+    def relevant_doc_scores(self, query_term_weights_dict, query_len_before_expension):
+        """
+        score all the docs of the query terms like score_docs, without combining the scores to a rank.
+        the rank needs the highest inner product of all the relevant docs, a shard of the index returns
+        the scores and gets the highest inner product of all the shards.
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param query_len_before_expension: number of query terms before expension
+        :return: (doc ordinals, inner products, cos sims, dates) parallel arrays of the relevant docs.
+        """
+        inner_products, n_terms_in_docs, _ = self._accumulate_scores(query_term_weights_dict)
+        return self._relevant_scores(np.flatnonzero(n_terms_in_docs), inner_products, n_terms_in_docs,
+                                     query_term_weights_dict, query_len_before_expension)
+
+    def _accumulate_scores(self, query_term_weights_dict, shared_posting_lists=None):
+        """
+        accumulate the inner product of every doc in a dense array indexed by doc ordinal, one posting list at a time.
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: (inner product of every doc ordinal, number of query terms in every doc ordinal, number of postings)
+        """
+        number_of_docs = self.indexer.number_of_docs()
+        inner_products = np.zeros(number_of_docs)
+        n_terms_in_docs = np.zeros(number_of_docs, dtype=np.int32)
+        n_postings = 0
+        for term, w_iq in query_term_weights_dict.items():
+            posting_list = self.get_term_posting_list(term, shared_posting_lists)
+            if len(posting_list) == 0:
+                continue
+            idf = self.indexer.inverted_idx[term][1]
+            docs = np.frombuffer(posting_list.docs, dtype=np.int32)
+            tfs = np.frombuffer(posting_list.weights, dtype=np.float32).astype(np.float64)
+            # w_ij * w_iq, a doc appears once in a posting list.
+            inner_products[docs] += tfs * idf * w_iq
+            n_terms_in_docs[docs] += 1
+            n_postings += len(docs)
+        return inner_products, n_terms_in_docs, n_postings
+
+    def score_docs_anytime(self, query_term_weights_dict, query_len_before_expension, time_budget=None,
+                           posting_budget=None, shared_posting_lists=None):
+        """
+        anytime version of score_docs: the postings of all the query terms are scored in impact order, the blocks
+        with the highest w_ij * w_iq first, until the time budget or the posting budget is over.
+        when the budget is over the docs are ranked by the postings that were scored, so the docs with the highest
+        contributions are usually already in place. when the budget is enough for all the postings the docs
+        are the same as in score_docs.
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param query_len_before_expension: number of query terms before expension
+        :param time_budget: seconds of scoring, None for no time limit
+        :param posting_budget: max number of postings to score, None for no limit
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: ((doc ordinals, ranks, dates) parallel arrays of the relevant docs, query stats)
+        """
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        number_of_docs = self.indexer.number_of_docs()
+        inner_products = np.zeros(number_of_docs)
+        n_terms_in_docs = np.zeros(number_of_docs, dtype=np.int32)
+        query_terms = []
+        # (-contribution of the next block head, term index, position of the block in the impact order)
+        blocks_heap = []
+        n_postings = 0
+        for term, w_iq in query_term_weights_dict.items():
+            posting_list = self.get_term_posting_list(term, shared_posting_lists)
+            if len(posting_list) == 0:
+                continue
+            idf = self.indexer.inverted_idx[term][1]
+            impact_order = np.frombuffer(self.indexer.get_term_impact_order(term), dtype=np.int32)
+            docs = np.frombuffer(posting_list.docs, dtype=np.int32)[impact_order]
+            contributions = np.frombuffer(posting_list.weights, dtype=np.float32)[impact_order].astype(np.float64) * idf * w_iq
+            query_terms.append((docs, contributions))
+            blocks_heap.append((-float(contributions[0]), len(query_terms) - 1, 0))
+            n_postings += len(docs)
+        heapq.heapify(blocks_heap)
+
+        n_scored_postings = 0
+        while blocks_heap:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            block_size = ANYTIME_BLOCK_SIZE
+            if posting_budget is not None:
+                block_size = min(block_size, posting_budget - n_scored_postings)
+                if block_size <= 0:
+                    break
+            _, term_idx, start = heapq.heappop(blocks_heap)
+            docs, contributions = query_terms[term_idx]
+            end = min(start + block_size, len(docs))
+            inner_products[docs[start:end]] += contributions[start:end]
+            n_terms_in_docs[docs[start:end]] += 1
+            n_scored_postings += end - start
+            if end < len(docs):
+                heapq.heappush(blocks_heap, (-float(contributions[end]), term_idx, end))
+
+        skipped_postings = n_postings - n_scored_postings
+        stats = {'postings': n_postings, 'skipped_postings': skipped_postings, 'exact': skipped_postings == 0}
+        return self._relevant_docs_of_scores(np.flatnonzero(n_terms_in_docs), inner_products, n_terms_in_docs,
+                                             query_term_weights_dict, query_len_before_expension), stats
+
+    def _relevant_docs_of_scores(self, scored_docs, inner_products, n_terms_in_docs, query_term_weights_dict,
+                                 query_len_before_expension):
+        """
+        filter the scored docs and rank them.
+        :param scored_docs: ordinals of the docs that were scored
+        :param inner_products: inner product of every doc ordinal
+        :param n_terms_in_docs: number of query terms in every doc ordinal
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param query_len_before_expension: number of query terms before expension
+        :return: (doc ordinals, ranks, dates) parallel arrays of the relevant docs.
+        """
+        doc_ordinals, inner_products, cos_sims, dates = self._relevant_scores(
+            scored_docs, inner_products, n_terms_in_docs, query_term_weights_dict, query_len_before_expension)
+        if len(doc_ordinals) == 0:
+            return doc_ordinals, inner_products, dates
+        # the rank of the combination between cos-sim and inner product
+        ranks = self.rank_combine(cos_sims, inner_products, inner_products.max())
+        return doc_ordinals, ranks, dates
+
+    def _relevant_scores(self, scored_docs, inner_products, n_terms_in_docs, query_term_weights_dict,
+                         query_len_before_expension):
+        """
+        filter the scored docs and calculate their cos sim.
+        :param scored_docs: ordinals of the docs that were scored
+        :param inner_products: inner product of every doc ordinal
+        :param n_terms_in_docs: number of query terms in every doc ordinal
+        :param query_term_weights_dict: {term : w_iq ...}
+        :param query_len_before_expension: number of query terms before expension
+        :return: (doc ordinals, inner products, cos sims, dates) parallel arrays of the relevant docs.
+        """
+        # if the doc have more than 40% of the terms in the query.
+        # if the query is short, than we believe that every term is important.
+        if query_len_before_expension < 4:
+            doc_ordinals = scored_docs
+        else:
+            doc_ordinals = scored_docs[n_terms_in_docs[scored_docs] > (query_len_before_expension*(40/100))]
+        inner_products = inner_products[doc_ordinals]
+        dates = np.frombuffer(self.indexer.doc_dates, dtype=np.int64)[doc_ordinals]
+        if len(doc_ordinals) == 0:
+            return doc_ordinals, inner_products, inner_products, dates
+        sqrt_segma_w_iq_pow = self.calculate_query_norm(query_term_weights_dict)
+        cos_sims = self.calculate_cos_sim(inner_products, sqrt_segma_w_iq_pow, doc_ordinals)
+        return doc_ordinals, inner_products, cos_sims, dates
 
     def rank_tf_idf_query(self, query_as_dict, query_len):
         """
@@ -47,37 +230,36 @@ class Ranker:
             query_term_weights_dict[term] = w_iq
         return query_term_weights_dict
 
-    def calculate_cos_sim(self, query_term_weights_dict, term_in_docs_tuple_list, doc_id):
+    def calculate_query_norm(self, query_term_weights_dict):
         """
-        calculate cos-sim between doc and the query.
+        calculate sqrt(w_iq^2) for the normalization of the cos-sim.
         :param query_term_weights_dict: {term : w_iq ...}
-        :param term_in_docs_tuple_list: [(term, w_ij) ...]
-        :param doc_id:
-        :return: cos_sim and inner product
+        :return: sqrt(w_iq^2)
         """
-        inner_product = 0
         segma_w_iq_pow = 0
-        # calculate inner product
         for term in query_term_weights_dict:
-            w_iq = query_term_weights_dict[term]
-            for tuple_term in term_in_docs_tuple_list:
-                if tuple_term[0] == term:
-                    w_ij = tuple_term[1]
-                    inner_product += w_ij * w_iq
-                    break
-            # calculation for the normalization of the cos-sim
-            segma_w_iq_pow += math.pow(w_iq, 2)
+            segma_w_iq_pow += math.pow(query_term_weights_dict[term], 2)
+        return math.sqrt(segma_w_iq_pow)
 
-        doc_sqrt_segma_wij_pow = self.indexer.weight_of_docs[doc_id]
-        sqrt_segma_w_iq_pow = math.sqrt(segma_w_iq_pow)
+    def calculate_cos_sim(self, inner_product, sqrt_segma_w_iq_pow, doc_ordinal):
+        """
+        calculate cos-sim between doc and the query.
+        works on a single doc or on arrays of docs.
+        :param inner_product: sum of w_ij * w_iq over the query terms in the doc
+        :param sqrt_segma_w_iq_pow: the norm of the query
+        :param doc_ordinal: the doc ordinal in the indexer
+        :return: cos_sim
+        """
+        doc_sqrt_segma_wij_pow = np.frombuffer(self.indexer.weight_of_docs, dtype=np.float64)[doc_ordinal]
 
         cos_sim_normalization = doc_sqrt_segma_wij_pow * sqrt_segma_w_iq_pow
         cos_sim = inner_product/cos_sim_normalization
-        return cos_sim, inner_product
+        return cos_sim
 
     def rank_combine(self, cos_sim, inner_product, max_inner_product):
         """
         calcute the similarity between query and doc with combination of methods to retrieve better results.
+        works on a single doc or on arrays of docs.
         :param cos_sim: the similarity in cos-sim method
         :param inner_product: the similarity in inner product method
         :param max_inner_product: the higher inner product similarity that we found for all docs.
@@ -1,5 +1,66 @@
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# the columns that the parser uses, the other columns are never read.
+PARSED_COLUMNS = ['tweet_id', 'tweet_date', 'full_text']
+DEFAULT_BATCH_SIZE = 10000
+# format of tweet_date, like "Mon Jul 27 00:32:26 +0000 2020".
+TWEET_DATE_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def date_string_to_int(tweet_date):
+    """
+    change the date of a tweet to int that keeps the same order (yyyymmddhhmmss).
+    :param tweet_date: date string of the tweet, like "Mon Jul 27 00:32:26 +0000 2020"
+    :return: date as int
+    """
+    splited_tweet_date = tweet_date.split(" ")
+    return int(splited_tweet_date[5] + "{:02d}".format(MONTHS[splited_tweet_date[1]]) + splited_tweet_date[2] +
+               splited_tweet_date[3].replace(":", ""))
+
+
+def normalize_dates(tweet_dates):
+    """
+    change the dates of a column of tweets to ints that keep the same order (yyyymmddhhmmss),
+    with the compute kernels of arrow (pandas when the kernels are missing in the installed pyarrow).
+    the dates that don't have the format of TWEET_DATE_FORMAT are changed one by one by date_string_to_int.
+    :param tweet_dates: arrow array of date strings
+    :return: list of dates as ints
+    """
+    try:
+        if hasattr(pc, 'strptime') and hasattr(pc, 'year'):
+            timestamps = pc.strptime(tweet_dates, format=TWEET_DATE_FORMAT, unit='s')
+            components = [pc.year(timestamps), pc.month(timestamps), pc.day(timestamps),
+                          pc.hour(timestamps), pc.minute(timestamps), pc.second(timestamps)]
+        else:
+            timestamps = pd.to_datetime(pd.Series(tweet_dates.to_pandas()), format=TWEET_DATE_FORMAT)
+            components = [timestamps.dt.year, timestamps.dt.month, timestamps.dt.day,
+                          timestamps.dt.hour, timestamps.dt.minute, timestamps.dt.second]
+    except (pa.ArrowInvalid, ValueError):
+        return [date_string_to_int(tweet_date) for tweet_date in tweet_dates.to_pylist()]
+    date_as_int = None
+    for component in components:
+        component = pa.array(component, type=pa.int64())
+        date_as_int = component if date_as_int is None else pc.add(pc.multiply(date_as_int, 100), component)
+    return date_as_int.to_pylist()
+
+
+def normalize_batch(record_batch):
+    """
+    prepare the columns of a batch of tweets for the parser: the tweet ids are cast to int64 and the dates
+    are changed to ints (normalize_dates), once for all the batch and not per tweet.
+    :param record_batch: arrow record batch with the columns of PARSED_COLUMNS
+    :return: list of tweets, each tweet is [tweet_id, tweet_date, full_text].
+    """
+    tweet_ids = pc.cast(record_batch.column(0), pa.int64()).to_pylist()
+    tweet_dates = normalize_dates(record_batch.column(1))
+    full_texts = record_batch.column(2).to_pylist()
+    return [list(document) for document in zip(tweet_ids, tweet_dates, full_texts)]
 
 
 class ReadFile:
@@ -16,3 +77,26 @@ class ReadFile:
         full_path = os.path.join(self.corpus_path, file_name)
         df = pd.read_parquet(full_path, engine="pyarrow")
         return df.values.tolist()
+
+    def read_file_batches(self, file_name, batch_size=None):
+        """
+        This function is reading a parquet file in batches of tweets, so the whole file is never in memory.
+        only the columns that the parser uses are read, and they are normalized by normalize_batch.
+        :param file_name: string - indicates the path to the file we wish to read.
+        :param batch_size: max number of tweets in a batch.
+        :return: generator of lists of tweets, each tweet is [tweet_id (int), tweet_date (int), full_text].
+        """
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZE
+        full_path = os.path.join(self.corpus_path, file_name)
+        parquet_file = pq.ParquetFile(full_path)
+        if hasattr(parquet_file, 'iter_batches'):
+            record_batches = parquet_file.iter_batches(batch_size=batch_size, columns=PARSED_COLUMNS)
+        else:
+            # older pyarrow versions can read only whole row groups.
+            record_batches = (record_batch
+                              for row_group in range(parquet_file.num_row_groups)
+                              for record_batch in parquet_file.read_row_group(row_group, columns=PARSED_COLUMNS)
+                              .to_batches(batch_size))
+        for record_batch in record_batches:
+            yield normalize_batch(record_batch)
@@ -0,0 +1,115 @@
+import collections
+import sys
+import threading
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'bytes', 'max_bytes'])
+
+
+class QueryResultCache:
+    """
+    LRU cache of search results, keyed on the normalized query (the query dict after spelling correction and
+    expansion), so different surface forms of the same query share an entry.
+    every entry belongs to a generation of the index. when the index changes (load, append, new weight of docs)
+    its generation changes and the cache is cleared on the next access.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        """
+        :param max_entries: max number of cached queries
+        :param max_bytes: memory budget (estimated bytes) of the cached results
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self.generation = None
+        # {key : (result, size)} from the least to the most recently used.
+        self._entries = collections.OrderedDict()
+        # searches can run in threads.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_of_query(query_as_dict, query_len, query_len_before_expension, k):
+        """
+        :param query_as_dict: {term : num of appearances in query} after expansion
+        :param query_len: length of the parsed query
+        :param query_len_before_expension: number of query terms before expension
+        :param k: number of top results
+        :return: hashable key of everything that the results depend on
+        """
+        return tuple(sorted(query_as_dict.items())), query_len, query_len_before_expension, k
+
+    @staticmethod
+    def size_of_result(key, result):
+        """
+        :param key: the key of the result
+        :param result: (number of relevant docs, list of tweet ids, query stats)
+        :return: estimated bytes of the entry
+        """
+        ranked_doc_ids = result[1]
+        return sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(ranked_doc_ids) + \
+            sum(sys.getsizeof(doc_id) for doc_id in ranked_doc_ids)
+
+    def _check_generation(self, generation):
+        """
+        clear the cache if the index changed. must be called with the lock.
+        :param generation: the current generation of the index
+        :return: False if the generation is older than the generation of the cache
+        """
+        if self.generation is not None and generation < self.generation:
+            return False
+        if generation != self.generation:
+            self._entries.clear()
+            self.bytes = 0
+            self.generation = generation
+        return True
+
+    def get(self, key, generation):
+        """
+        :param key: key_of_query of the query
+        :param generation: the generation of the index
+        :return: the cached result, None if it is not cached
+        """
+        with self._lock:
+            if self._check_generation(generation) and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, result, generation):
+        """
+        cache a result and evict the least recently used results over the budget.
+        :param key: key_of_query of the query
+        :param result: (number of relevant docs, list of tweet ids, query stats)
+        :param generation: the generation of the index when the search started
+        :return:
+        """
+        size = self.size_of_result(key, result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # the index changed during the search.
+            if not self._check_generation(generation):
+                return
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def cache_info(self):
+        """
+        :return: CacheInfo(hits, misses, maxsize, currsize, bytes, max_bytes) like functools.lru_cache
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.max_entries, len(self._entries), self.bytes,
+                             self.max_bytes)
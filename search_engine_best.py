@@ -1,11 +1,8 @@
-import pandas as pd
-from reader import ReadFile
-from configuration import ConfigClass
 from parser_module import Parse
 from indexer import Indexer
 from searcher import Searcher
-import collections
-import utils
+import index_builder
+import query_expansion
 
 
 # DO NOT CHANGE THE CLASS NAME
@@ -21,6 +18,8 @@ class SearchEngine:
         self._indexer = Indexer(config)
         self._model = None
         self.number_of_documents_in_corpus = 0
+        # long lived searcher, built when the index is ready.
+        self._searcher = None
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
@@ -32,40 +31,45 @@ class SearchEngine:
         Output:
             No output, just modifies the internal _indexer object.
         """
-        df = pd.read_parquet(fn, engine="pyarrow")
-        documents_list = df.values.tolist()
-        # Iterate over every document in the file
-        for idx, document in enumerate(documents_list):
-            # parse the document
-            parsed_document = self._parser.parse_doc(document)
-            self.number_of_documents_in_corpus += 1
-            # index the document data
-            self._indexer.add_new_doc(parsed_document)
-
-        # handle the case of capital letters according to partA rules.
-        self._indexer.handle_capital_letters(self._parser)
-
-        self._indexer.add_idf_to_inverted_index(self.number_of_documents_in_corpus)
-        # build dict of {doc_id : sqrt(w_ij^2) ...}
-        self._indexer.build_weight_of_docs()
-
-        self._indexer.remove_all_the_term_with_1_appearance()
+        # a build starts a new index, the index that was built or loaded before is dropped (with its build files).
+        self._indexer.cleanup()
+        self._parser = Parse()
+        self._indexer = Indexer(self._config)
+        self.number_of_documents_in_corpus = 0
+        # read the file in batches and parse it (in a process pool if the config asks for it)
+        self.number_of_documents_in_corpus += index_builder.index_parquet_file(self._parser, self._indexer, fn,
+                                                                               self._config)
 
-        # sort the inverted index and postiong dicts in alphabet order
-        self._indexer.inverted_idx = collections.OrderedDict(sorted(self._indexer.inverted_idx.items()))
-        self._indexer.postingDict = collections.OrderedDict(sorted(self._indexer.postingDict.items()))
+        # capital letters, idf, weight of docs, rare terms removal and sorting.
+        self._indexer.finalize_index(self._parser, self.number_of_documents_in_corpus)
+        self._start_query_session()
         # print('Finished parsing and indexing.')
         # self._indexer.save_index("idx_bench")
 
+    def append_parquet(self, fn):
+        """
+        Adds the tweets of a new parquet file to the existing index without rebuilding it.
+        the new tweets are searchable when it returns, the weights of the older tweets are updated in the background.
+        Input:
+            fn - path to parquet file
+        """
+        self.number_of_documents_in_corpus += index_builder.append_parquet_file(self._parser, self._indexer, fn,
+                                                                                self._config)
+        if self._model is not None:
+            # the new tweets may add terms that the tables of the model don't have.
+            self._start_query_session()
+
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
     def load_index(self, fn):
         """
         Loads a pre-computed index (or indices) so we can answer queries.
         Input:
-            fn - file name of pickled index.
+            fn - file name of pickled index, or the prefix of the binary index files.
         """
         self._indexer.load_index(fn)
+        self.number_of_documents_in_corpus = len(self._indexer.doc_ids)
+        self._start_query_session()
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
@@ -74,26 +78,64 @@ class SearchEngine:
         Loads a pre-computed model (or models) so we can answer queries.
         This is where you would load models like word2vec, LSI, LDA, etc. and 
         assign to self._model, which is passed on to the searcher at query time.
+        here the model is the table of the wordNet words of every term in the index, it is built and saved
+        to model_dir when it is not there (or was built for another index).
         """
-        pass
+        if model_dir is None:
+            return
+        fingerprint = query_expansion.lexicon_fingerprint(self._indexer.inverted_idx)
+        table = query_expansion.load_or_build_table(model_dir, query_expansion.WORDNET_TABLE_FILE,
+                                                    query_expansion.build_wordnet_table, self._indexer.inverted_idx,
+                                                    fingerprint)
+        self._model = {'fingerprint': fingerprint, 'wordnet': table}
+        # the searcher gets the model.
+        self._start_query_session()
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
-    def search(self, query):
+    def search(self, query, k=None):
         """ 
         Executes a query over an existing index and returns the number of 
         relevant docs and an ordered list of search results.
         Input:
             query - string.
+            k - number of top results to return, default to everything.
         Output:
             A tuple containing the number of relevant search results, and 
             a list of tweet_ids where the first element is the most relavant 
             and the last is the least relevant result.
         """
+        if self._searcher is None:
+            self._start_query_session()
+        return self._searcher.search(query, k)
+
+    def search_many(self, queries, k=None):
+        """
+        Executes a batch of queries, the posting list of a term that several queries share is read once.
+        Input:
+            queries - iterable of query strings.
+            k - number of top results to return for every query, default to everything.
+        Output:
+            A list with the result of every query, in the format of search.
+        """
+        if self._searcher is None:
+            self._start_query_session()
+        processes = self._config.get_search_processes() if self._config is not None else 1
+        return self._searcher.search_many(queries, k, processes)
+
+    def _start_query_session(self):
+        """
+        build the searcher that answers all the queries and load the resources of its methods,
+        so every query does only the retrieval work.
+        """
+        # a model that was built for another lexicon is dropped, load_precomputed_model builds it again.
+        self._model = query_expansion.model_of_index(self._model, self._indexer.inverted_idx)
         searcher = Searcher(self._parser, self._indexer, model=self._model)
         searcher.set_spelling_correction()
         searcher.set_wordNet()
-
-        return searcher.search(query)
+        if self._config is not None and self._config.get_query_cache_size() > 0:
+            searcher.set_result_cache(self._config.get_query_cache_size(), self._config.get_query_cache_memory())
+        searcher.warm_up()
+        self._searcher = searcher
 
 
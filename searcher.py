@@ -1,15 +1,46 @@
+import collections
+import multiprocessing
 from ranker import Ranker
-import utils
-import nltk
-from nltk.tokenize import word_tokenize
+from result_cache import QueryResultCache
+import query_expansion
 from nltk.corpus import lin_thesaurus as thes
-from nltk import pos_tag
+from nltk.tag.perceptron import PerceptronTagger
 # nltk.download('averaged_perceptron_tagger')
 # nltk.download('lin_thesaurus')
 # nltk.download('wordnet')
-from spellchecker import SpellChecker
 from nltk.corpus import wordnet
 
+# query resources that are expensive to build, they are built once per process and shared by all the searchers.
+_pos_tagger = None
+# searcher of a worker process of search_many, and the posting lists that were read for the batch.
+_worker_searcher = None
+_worker_posting_lists = None
+
+
+def get_pos_tagger():
+    """
+    nltk.pos_tag loads the tagger model on every call, so the tagger is kept here.
+    :return: the part of speech tagger of the process.
+    """
+    global _pos_tagger
+    if _pos_tagger is None:
+        _pos_tagger = PerceptronTagger()
+    return _pos_tagger
+
+
+def _init_search_worker(searcher, shared_posting_lists):
+    global _worker_searcher, _worker_posting_lists
+    _worker_searcher = searcher
+    _worker_posting_lists = shared_posting_lists
+
+
+def _search_normalized_query_in_worker(normalized_query):
+    """
+    :param normalized_query: (query_as_dict, query length, query length before expension, k)
+    :return: (number of relevant docs, list of tweet ids, query stats)
+    """
+    return _worker_searcher._search_normalized_query(*normalized_query, shared_posting_lists=_worker_posting_lists)
+
 
 # DO NOT MODIFY CLASS NAME
 class Searcher:
@@ -27,6 +58,12 @@ class Searcher:
         self.with_thesaurus = False
         self.with_spelling_correction = False
         self.with_wordNet = False
+        # {'postings': .., 'skipped_postings': .., 'exact': ..} of the last query, a copy for convenience that
+        # search and search_many set when they return (with many threads it is the stats of one of their queries).
+        # 'exact' is False when the budget of the search was over before all the postings were scored.
+        self.last_query_stats = None
+        # QueryResultCache of the searches, None to search every query.
+        self.result_cache = None
 
     def set_thesaurus(self):
         self.with_thesaurus = True
@@ -37,120 +74,179 @@ class Searcher:
     def set_wordNet(self):
         self.with_wordNet = True
 
+    def set_result_cache(self, max_entries, max_bytes):
+        self.result_cache = QueryResultCache(max_entries, max_bytes)
+
+    def warm_up(self):
+        """
+        load the resources of the methods that are set, so the first query doesn't pay for them.
+        :return:
+        """
+        if self.with_spelling_correction:
+            self._indexer.get_spelling_corrector()
+        model = self._model if self._model is not None else {}
+        # the corpus is loaded lazily on the first lookup, it is not needed with the precomputed table.
+        if self.with_wordNet and 'wordnet' not in model:
+            wordnet.synsets("warm")
+        if self.with_thesaurus:
+            get_pos_tagger()
+            if 'thesaurus' not in model:
+                thes.synonyms("warm", fileid="simN.lsp")
+
     def spelling_correction_checker(self, query_as_list):
         """
         check that all the word spelled correctly and fix it if misspelled.
+        the correction is the closest term of the index, so it is always a term that can be retrieved.
         :param query_as_list: the parsed query
         :return:
         """
-        spell = SpellChecker()
+        spelling_corrector = self._indexer.get_spelling_corrector()
         for idx, term in enumerate(query_as_list):
             # if term not in inverted index then we will try to fix it.
-            if term not in self._indexer.inverted_idx:
-                misspelled = spell.unknown([term])
-                for word in misspelled:  # if we found that the word is misspelled.
-                    correct_word = spell.correction(word)
-                    if correct_word in self._indexer.inverted_idx:
-                        query_as_list[idx] = correct_word
+            if term not in self._indexer.inverted_idx and term.upper() not in self._indexer.inverted_idx:
+                correct_word = spelling_corrector.correction(term)
+                if correct_word is not None:
+                    query_as_list[idx] = correct_word
 
     def build_wordNet_for_query(self, query_as_dict):
         """
         query expansion in wordNet method.
+        the words of every term are taken from the precomputed table of the model if there is one.
         :param query_as_dict: {term : num of appearances in query}
         :return:
         """
+        wordnet_table = self._model.get('wordnet') if self._model is not None else None
         list_of_terms = list(query_as_dict.keys())
         for idx, term in enumerate(list_of_terms):
             # expand half of the terms in query
             if idx % 2 != 0:
                 continue
-            syn = True
-            ant = True
-            for synset in wordnet.synsets(term):
-                for lemma in synset.lemmas():
-                    # if we didn't get synonm to the term
-                    if syn:
-                        lemma_name = lemma.name()
-                        # if the synonm word is not similar to the term.
-                        if not lemma_name.startswith(term):
-                            # if the word appear in capital letters in inverted index
-                            if lemma_name.upper() in self._indexer.inverted_idx:
-                                lemma_name = lemma_name.upper()
-                            if lemma_name in self._indexer.inverted_idx:
-                                # add the words to dict, but with lower weight.
-                                if lemma_name in query_as_dict:
-                                    query_as_dict[lemma_name] += 0.5
-                                else:
-                                    query_as_dict[lemma_name] = 0.5
-                                syn = False
-                    # get list of opposite words
-                    lemma_antonyms = lemma.antonyms()
-                    if ant and lemma_antonyms:
-                        lemma_antonyms_name = lemma_antonyms[0].name()
-                        # if the word appear in capital letters in inverted index
-                        if lemma_antonyms_name.upper() in self._indexer.inverted_idx:
-                            lemma_antonyms_name = lemma_antonyms_name.upper()
-                        if lemma_antonyms_name in self._indexer.inverted_idx:
-                            # add the words to dict, but with lower weight.
-                            if lemma_antonyms_name in query_as_dict:
-                                query_as_dict[lemma_antonyms_name] += 0.4
-                            else:
-                                query_as_dict[lemma_antonyms_name] = 0.4
-                            ant = False
-                # we want to add only 2 words for each term that we want to expand
-                if not ant and not syn:
-                    break
+            if wordnet_table is not None:
+                expansion = wordnet_table.get(term, [])
+            else:
+                expansion = query_expansion.wordnet_expansion_of_term(term, self._indexer.inverted_idx)
+            for word, weight in expansion:
+                # add the words to dict, but with lower weight.
+                if word in query_as_dict:
+                    query_as_dict[word] += weight
+                else:
+                    query_as_dict[word] = weight
 
     def build_thesaurus_for_query(self, query_as_dict):
         """
         query expansion in thesaurus method.
+        the words of every term are taken from the precomputed table of the model if there is one.
         :param query_as_dict: {term : num of appearances in query}
         :return:
         """
+        thesaurus_table = self._model.get('thesaurus') if self._model is not None else None
         list_of_terms = list(query_as_dict.keys())
         # get the part of speech tag of the word in the query context.
-        parts_of_speech_tags = pos_tag(list_of_terms)
+        parts_of_speech_tags = get_pos_tagger().tag(list_of_terms)
         for word, word_type in parts_of_speech_tags:
-            # if word is noun
-            if word_type == "NN":
-                list_from_thes = list(thes.synonyms(word, fileid="simN.lsp"))
-            # if word is verb
-            elif word_type == "VB":
-                list_from_thes = list(thes.synonyms(word, fileid="simV.lsp"))
-            # if word is adjective
-            elif word_type == "JJ":
-                list_from_thes = list(thes.synonyms(word, fileid="simA.lsp"))
+            if thesaurus_table is not None:
+                words_from_thes = thesaurus_table.get(word, {}).get(word_type, [])
             else:
-                continue
-
-            if len(list_from_thes) > 1:
-                words_from_thes = list_from_thes[:2]
-                for word_from_thes in words_from_thes:
-                    # if the word appear in capital letters in inverted index
-                    if word_from_thes.upper() in self._indexer.inverted_idx:
-                        word_from_thes = word_from_thes.upper()
-                    if word_from_thes in self._indexer.inverted_idx:
-                        # add the words to dict, but with lower weight.
-                        if word_from_thes in query_as_dict:
-                            query_as_dict[word_from_thes] += 0.4
-                        else:
-                            query_as_dict[word_from_thes] = 0.4
+                words_from_thes = query_expansion.thesaurus_expansion_of_term(word, word_type,
+                                                                              self._indexer.inverted_idx)
+            for word_from_thes in words_from_thes:
+                # add the words to dict, but with lower weight.
+                if word_from_thes in query_as_dict:
+                    query_as_dict[word_from_thes] += query_expansion.THESAURUS_WEIGHT
+                else:
+                    query_as_dict[word_from_thes] = query_expansion.THESAURUS_WEIGHT
 
     # DO NOT MODIFY THIS SIGNATURE
     # You can change the internal implementation as you see fit.
-    def search(self, query, k=None):
+    def search(self, query, k=None, time_budget=None, posting_budget=None):
         """
         Executes a query over an existing index and returns the number of
         relevant docs and an ordered list of search results (tweet ids).
         Input:
             query - string.
             k - number of top results to return, default to everything.
+            time_budget - seconds to score the postings, default to no limit.
+            posting_budget - max number of postings to score, default to no limit.
+            with a budget the postings are scored in impact order until the budget is over, and
+            last_query_stats['exact'] tells if the results are exact or approximate.
         Output:
             A tuple containing the number of relevant search results, and
             a list of tweet_ids where the first element is the most relavant
             and the last is the least relevant result.
         """
-        query_as_list = self._parser.parse_sentence(query)
+        query_as_dict, query_len, query_len_before_expension = self._normalized_query(query)
+
+        # the results of a search with a budget depend on the budget, they are not cached.
+        cache_key = None
+        if self.result_cache is not None and time_budget is None and posting_budget is None:
+            generation = self._indexer.generation
+            cache_key = QueryResultCache.key_of_query(query_as_dict, query_len, query_len_before_expension, k)
+            cached_result = self.result_cache.get(cache_key, generation)
+            if cached_result is not None:
+                n_relevant, ranked_doc_ids, self.last_query_stats = cached_result
+                return n_relevant, list(ranked_doc_ids)
+
+        n_relevant, ranked_doc_ids, query_stats = self._search_normalized_query(
+            query_as_dict, query_len, query_len_before_expension, k, time_budget, posting_budget)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, (n_relevant, list(ranked_doc_ids), query_stats), generation)
+        self.last_query_stats = query_stats
+        return n_relevant, ranked_doc_ids
+
+    def search_many(self, queries, k=None, processes=1):
+        """
+        search a batch of queries. all the queries are parsed and expanded first, the posting list of every
+        distinct term is read (and decoded) once for all the queries, and every distinct query is scored once.
+        :param queries: iterable of query strings
+        :param k: number of top results to return for every query, default to everything.
+        :param processes: number of worker processes that score the queries (1 means no process pool).
+                          the workers are forked with the searcher and the posting lists that were read, the
+                          searcher (mmap'd postings, the lock of the result cache) can't be sent to a spawned
+                          process. where fork is not available (Windows) the queries are scored in this process.
+        :return: list of (number of relevant docs, list of tweet ids), in the order of the queries,
+                 the same results that search returns.
+        """
+        normalized_queries = [self._normalized_query(query) for query in queries]
+        generation = self._indexer.generation
+        # {key : [positions of the queries with this key]} of the queries that are not cached.
+        positions_of_keys = collections.OrderedDict()
+        results = [None] * len(normalized_queries)
+        for position, (query_as_dict, query_len, query_len_before_expension) in enumerate(normalized_queries):
+            key = QueryResultCache.key_of_query(query_as_dict, query_len, query_len_before_expension, k)
+            if self.result_cache is not None:
+                results[position] = self.result_cache.get(key, generation)
+            if results[position] is None:
+                positions_of_keys.setdefault(key, []).append(position)
+
+        pending_queries = [normalized_queries[positions[0]] + (k,) for positions in positions_of_keys.values()]
+        terms = set(term for query_as_dict, _, _, _ in pending_queries for term in query_as_dict)
+        shared_posting_lists = {term: self._indexer.get_term_posting_list(term) for term in terms}
+        if processes > 1 and len(pending_queries) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # fork is asked explicitly, the default start method is spawn on macOS.
+            with multiprocessing.get_context('fork').Pool(processes, initializer=_init_search_worker,
+                                                          initargs=(self, shared_posting_lists)) as pool:
+                pending_results = pool.map(_search_normalized_query_in_worker, pending_queries)
+        else:
+            pending_results = [self._search_normalized_query(*pending_query,
+                                                             shared_posting_lists=shared_posting_lists)
+                               for pending_query in pending_queries]
+
+        for (key, positions), result in zip(positions_of_keys.items(), pending_results):
+            if self.result_cache is not None:
+                self.result_cache.put(key, result, generation)
+            for position in positions:
+                results[position] = result
+        if results:
+            self.last_query_stats = results[-1][2]
+        return [(n_relevant, list(ranked_doc_ids)) for n_relevant, ranked_doc_ids, _ in results]
+
+    def _normalized_query(self, query):
+        """
+        parse the query, correct its spelling and expand it, the way that search does.
+        :param query: query string
+        :return: (query_as_dict, length of the parsed query, number of query terms before expension)
+        """
+        query_as_list = self._parser.parse_query(query)
 
         if self.with_spelling_correction:
             self.spelling_correction_checker(query_as_list)
@@ -173,65 +269,48 @@ class Searcher:
 
         if self.with_wordNet:
             self.build_wordNet_for_query(query_as_dict)
+        return query_as_dict, len(query_as_list), query_len_before_expension
 
+    def _search_normalized_query(self, query_as_dict, query_len, query_len_before_expension, k=None,
+                                 time_budget=None, posting_budget=None, shared_posting_lists=None):
+        """
+        score and rank the docs of a normalized query.
+        :param query_as_dict: {term : num of appearances in query} after expansion
+        :param query_len: length of the parsed query
+        :param query_len_before_expension: number of query terms before expension
+        :param k: number of top results, None for all of them.
+        :param time_budget: seconds to score the postings, None for no limit.
+        :param posting_budget: max number of postings to score, None for no limit.
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: (number of relevant docs, list of tweet ids, query stats)
+        """
         # get all the relevant docs
-        relevant_docs = self._relevant_docs_from_posting(query_as_dict, len(query_as_list), query_len_before_expension)
-        n_relevant = len(relevant_docs)
+        relevant_docs, query_stats = self._relevant_docs_from_posting(
+            query_as_dict, query_len, query_len_before_expension, time_budget, posting_budget, shared_posting_lists)
+        n_relevant = len(relevant_docs[0])
         # rank the docs by similarity
-        ranked_doc_ids = Ranker.rank_relevant_docs(relevant_docs, k)
-        return n_relevant, ranked_doc_ids
+        ranked_doc_ordinals = Ranker.rank_relevant_docs(relevant_docs, k)
+        ranked_doc_ids = [self._indexer.get_tweet_id(doc_ordinal) for doc_ordinal in ranked_doc_ordinals]
+        return n_relevant, ranked_doc_ids, query_stats
 
     # feel free to change the signature and/or implementation of this function 
     # or drop altogether.
-    def _relevant_docs_from_posting(self, query_as_dict, query_len, query_len_before_expension):
+    def _relevant_docs_from_posting(self, query_as_dict, query_len, query_len_before_expension, time_budget=None,
+                                    posting_budget=None, shared_posting_lists=None):
         """
-        This function loads the posting list and count the amount of relevant documents per term.
+        This function loads the posting list of every query term and scores the documents.
+        with a budget, the postings are scored in impact order until the budget is over.
         :param query_as_dict: {term : num of appearances in query}
         :param query_len: length of parsed query
         :param query_len_before_expension: length of dict before expension
-        :return: dictionary of relevant documents mapping doc_id to document rank and date.
+        :param time_budget: seconds to score the postings, None for no limit.
+        :param posting_budget: max number of postings to score, None for no limit.
+        :param shared_posting_lists: {term : PostingList} that were already read for a batch of queries, or None
+        :return: ((doc ordinals, ranks, dates) parallel arrays of the relevant documents, query stats)
         """
-        relevant_docs = {}
-        relevant_docs_with_weight = {}
         # build dictionary of {term : w_iq ...}
         query_term_weights_dict = self._ranker.rank_tf_idf_query(query_as_dict, query_len)
-        for term in query_term_weights_dict:
-            posting_list = self._indexer.get_term_posting_list(term)
-            # for each doc that the term appear in.
-            for list_in_posting_list in posting_list:
-                doc_id = list_in_posting_list[0]
-                w_ij = list_in_posting_list[4]
-                doc_date = list_in_posting_list[3]
-                if doc_id in relevant_docs_with_weight:
-                    relevant_docs_with_weight[doc_id][1].append((term, w_ij))
-                else:
-                    relevant_docs_with_weight[doc_id] = [doc_date, [(term, w_ij)]]
-        doc_id_to_cosine_and_inner = {}
-        max_inner_product = 0
-        for doc_id in relevant_docs_with_weight:
-            # if the doc have more than 40% of the terms in the query.
-            if len(relevant_docs_with_weight[doc_id][1]) > (query_len_before_expension*(40/100)):
-                cos_sim, inner_product = self._ranker.calculate_cos_sim(query_term_weights_dict, relevant_docs_with_weight[doc_id][1], doc_id)
-                # build dict of {doc_id: (cos_sim, date, inner product) ...}
-                doc_id_to_cosine_and_inner[doc_id] = (cos_sim, relevant_docs_with_weight[doc_id][0], inner_product)
-                # find the higher inner product from all docs to the current query.
-                if max_inner_product < inner_product:
-                    max_inner_product = inner_product
-            # if the query is short, than we believe that every term is important.
-            elif query_len_before_expension < 4:
-                cos_sim, inner_product = self._ranker.calculate_cos_sim(query_term_weights_dict, relevant_docs_with_weight[doc_id][1], doc_id)
-                # build dict of {doc_id: (cos_sim, date, inner product) ...}
-                doc_id_to_cosine_and_inner[doc_id] = (cos_sim, relevant_docs_with_weight[doc_id][0], inner_product)
-                # find the higher inner product from all docs to the current query.
-                if max_inner_product < inner_product:
-                    max_inner_product = inner_product
-
-        # calculate the rank of the combination between cos-sim and inner product
-        for doc_id in doc_id_to_cosine_and_inner:
-            tup = doc_id_to_cosine_and_inner[doc_id]
-            cos_sim = tup[0]
-            date = tup[1]
-            inner_product = tup[2]
-            rank = self._ranker.rank_combine(cos_sim, inner_product, max_inner_product)
-            relevant_docs[doc_id] = (rank, date)
-        return relevant_docs
+        if time_budget is not None or posting_budget is not None:
+            return self._ranker.score_docs_anytime(query_term_weights_dict, query_len_before_expension,
+                                                   time_budget, posting_budget, shared_posting_lists)
+        return self._ranker.score_docs(query_term_weights_dict, query_len_before_expension, shared_posting_lists)
@@ -0,0 +1,114 @@
+import math
+from collections.abc import Mapping
+from posting_list import PostingList
+
+
+class SegmentsLexicon(Mapping):
+    """
+    {term : (df, idf)} view over the lexicon of the base index and the df of the appended segments.
+    the idf is calculated from the global df and the current number of docs, so it is never stale.
+    a term that was saved in capital letters in the base index and later appeared in lower case is saved
+    in lower case, the base index is read only so the lower case term is an alias to the capital letters term.
+    """
+
+    def __init__(self, base_lexicon, appended_df, indexer, base_aliases=None):
+        """
+        :param base_lexicon: {term : (df, idf)} of the base index
+        :param appended_df: {term : df in the appended segments}
+        :param indexer: the indexer, gives the current number of docs
+        :param base_aliases: {lower case term : capital letters term of the base index}
+        """
+        self._base_lexicon = base_lexicon
+        self._appended_df = appended_df
+        self._indexer = indexer
+        self._base_aliases = base_aliases if base_aliases is not None else {}
+        self._hidden_base_terms = set(self._base_aliases.values())
+
+    def add_base_alias(self, term, base_term):
+        """
+        save base_term of the base index as term from now on.
+        :param term: the lower case term
+        :param base_term: the capital letters term in the base index
+        :return:
+        """
+        self._base_aliases[term] = base_term
+        self._hidden_base_terms.add(base_term)
+
+    def base_term(self, term):
+        """
+        :param term: term of the index
+        :return: the term that holds its postings in the base index, None if it is not in the base index.
+        """
+        if term in self._hidden_base_terms:
+            return None
+        base_term = self._base_aliases.get(term, term)
+        return base_term if base_term in self._base_lexicon else None
+
+    def __getitem__(self, term):
+        d_ft = self._appended_df.get(term, 0)
+        base_term = self.base_term(term)
+        if base_term is not None:
+            d_ft += self._base_lexicon[base_term][0]
+        if d_ft == 0:
+            raise KeyError(term)
+        return d_ft, math.log2(self._indexer.number_of_docs() / d_ft)
+
+    def __contains__(self, term):
+        return term in self._appended_df or self.base_term(term) is not None
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        for term in self._base_lexicon:
+            if term not in self._hidden_base_terms:
+                yield term
+        for term in self._base_aliases:
+            if term not in self._base_lexicon:
+                yield term
+        for term in self._appended_df:
+            if self.base_term(term) is None:
+                yield term
+
+
+class SegmentsPostings(Mapping):
+    """
+    {term : PostingList} view over the postings of the base index and the appended segments.
+    the doc ordinals of every segment come after the ordinals of the previous ones, so the concatenated
+    posting list stays sorted by doc.
+    """
+
+    def __init__(self, base_postings, segments, lexicon):
+        """
+        :param base_postings: {term : PostingList} of the base index
+        :param segments: list of {term : PostingList} of the appended segments, in the order they were appended
+        :param lexicon: SegmentsLexicon of the same index
+        """
+        self._base_postings = base_postings
+        self._segments = segments
+        self._lexicon = lexicon
+
+    def __getitem__(self, term):
+        posting_lists = [postings[term] for postings in self._segments if term in postings]
+        base_term = self._lexicon.base_term(term)
+        if base_term is not None:
+            posting_lists.insert(0, self._base_postings[base_term])
+        if len(posting_lists) == 0:
+            raise KeyError(term)
+        if len(posting_lists) == 1:
+            return posting_lists[0]
+        merged_posting_list = PostingList()
+        for posting_list in posting_lists:
+            merged_posting_list.docs.extend(posting_list.docs)
+            merged_posting_list.freqs.extend(posting_list.freqs)
+            merged_posting_list.weights.extend(posting_list.weights)
+        return merged_posting_list
+
+    def __contains__(self, term):
+        return term in self._lexicon
+
+    def __len__(self):
+        return len(self._lexicon)
+
+    def __iter__(self):
+        return iter(self._lexicon)
@@ -0,0 +1,375 @@
+import os
+import pickle
+import threading
+from array import array
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import numpy as np
+import utils
+from indexer import Indexer
+from ranker import Ranker
+from reader import ReadFile
+from searcher import Searcher
+
+COORDINATOR_FILE = 'coordinator'
+
+
+def shard_of_tweet(tweet_id, n_shards):
+    """
+    :param tweet_id: tweet id
+    :param n_shards: number of shards
+    :return: the shard of the tweet
+    """
+    return int(tweet_id) % n_shards
+
+
+def shard_fn(shards_dir, shard):
+    """
+    :param shards_dir: folder of the sharded index
+    :param shard: number of the shard
+    :return: prefix of the index files of the shard
+    """
+    return os.path.join(shards_dir, 'shard_{}'.format(shard))
+
+
+def build_shards(parser, fn, n_shards, shards_dir, config=None):
+    """
+    index the tweets of the parquet file in n_shards shards, partitioned by tweet id, and save every shard as
+    a binary index in shards_dir.
+    the build has two passes, so only one shard is in memory at a time:
+        1. the tweets are parsed by one parser in the order of the file, so the corpus state of the parser is the
+           same as in a build of one index. the df of every term is counted over all the corpus, and the parsed
+           docs of every shard are written to a routing file of the shard.
+        2. the shards are built one after the other from their routing files and finalized with the corpus idf,
+           so the weights of the docs of a shard are the weights they have in the index of all the corpus.
+           every shard is saved and released before the next shard is built.
+    the coordinator file of the shards has the lexicon of the corpus, that the coordinator uses to parse, correct
+    and expand the queries and to weight their terms.
+    :param parser: the parser of the search engine
+    :param fn: path to parquet file
+    :param n_shards: number of shards
+    :param shards_dir: folder of the sharded index
+    :param config: ConfigClass or None
+    :return: number of documents that were indexed
+    """
+    os.makedirs(shards_dir, exist_ok=True)
+    routing_fns = [shard_fn(shards_dir, shard) + '.routing' for shard in range(n_shards)]
+    corpus_df, number_of_documents = _route_documents(parser, fn, n_shards, routing_fns, config)
+
+    # the lexicon of the corpus is made by the same stages as the index of the corpus, without postings.
+    lexicon_indexer = Indexer(config)
+    lexicon_indexer.inverted_idx = corpus_df
+    lexicon_indexer.postingDict = dict.fromkeys(corpus_df)
+    lexicon_indexer.handle_capital_letters(parser)
+    lexicon_indexer.add_idf_to_inverted_index(number_of_documents)
+
+    for shard, routing_fn in enumerate(routing_fns):
+        _build_shard(routing_fn, shard_fn(shards_dir, shard), parser.upper_case_dict, lexicon_indexer.inverted_idx,
+                     config)
+        os.remove(routing_fn)
+
+    lexicon_indexer.remove_all_the_term_with_1_appearance()
+    lexicon_indexer.sort_index()
+    utils.save_obj((n_shards, lexicon_indexer.inverted_idx, number_of_documents),
+                   os.path.join(shards_dir, COORDINATOR_FILE))
+    return number_of_documents
+
+
+def _route_documents(parser, fn, n_shards, routing_fns, config):
+    """
+    the first pass of build_shards: parse the tweets, count the df of the terms of the corpus, and write the parsed
+    docs of every shard to its routing file.
+    :param parser: the parser of the search engine
+    :param fn: path to parquet file
+    :param n_shards: number of shards
+    :param routing_fns: path of the routing file of every shard
+    :param config: ConfigClass or None
+    :return: ({term : df} of the corpus in the order that the terms first appear in the corpus, number of documents)
+    """
+    corpus_df = {}
+    number_of_documents = 0
+    batch_size = config.get_parquet_batch_size() if config is not None else None
+    routing_files = [open(routing_fn, 'wb') for routing_fn in routing_fns]
+    try:
+        for documents_list in ReadFile(corpus_path="").read_file_batches(fn, batch_size):
+            # (ordinal of the doc in the corpus, parsed doc) of every shard, the ordinal decides between docs
+            # with the same rank and date.
+            shard_batches = [[] for _ in range(n_shards)]
+            for document in documents_list:
+                parsed_document = parser.parse_doc(document)
+                shard_batches[shard_of_tweet(parsed_document.tweet_id, n_shards)].append(
+                    (number_of_documents, parsed_document))
+                number_of_documents += 1
+                for term in parsed_document.terms:
+                    corpus_df[term] = corpus_df.get(term, 0) + 1
+            for routing_file, shard_batch in zip(routing_files, shard_batches):
+                if len(shard_batch) > 0:
+                    pickle.dump(shard_batch, routing_file, pickle.HIGHEST_PROTOCOL)
+    finally:
+        for routing_file in routing_files:
+            routing_file.close()
+    return corpus_df, number_of_documents
+
+
+def _build_shard(routing_fn, fn, upper_case_dict, global_inverted_idx, config):
+    """
+    index the parsed docs of the routing file of a shard, finalize the shard with the corpus statistics
+    and save it. the index of the shard is released when it returns.
+    :param routing_fn: path of the routing file of the shard
+    :param fn: prefix of the index files of the shard
+    :param upper_case_dict: upper case dictionary of the corpus (see Indexer.finalize_shard)
+    :param global_inverted_idx: {term : (df, idf)} of all the corpus (see Indexer.finalize_shard)
+    :param config: ConfigClass or None
+    :return:
+    """
+    shard_indexer = Indexer(config)
+    # the shard is finalized with the corpus statistics, it is kept in memory until then.
+    shard_indexer.memory_budget = None
+    corpus_ordinals = array('q')
+    with open(routing_fn, 'rb') as routing_file:
+        while True:
+            try:
+                shard_batch = pickle.load(routing_file)
+            except EOFError:
+                break
+            for corpus_ordinal, parsed_document in shard_batch:
+                shard_indexer.add_new_doc(parsed_document)
+                corpus_ordinals.append(corpus_ordinal)
+    shard_indexer.finalize_shard(upper_case_dict, global_inverted_idx)
+    shard_indexer.save_index(fn)
+    utils.save_obj(corpus_ordinals, fn + '.ordinals')
+
+
+class ShardSearcher:
+    """
+    answer the two phases of a sharded search over the index of one shard:
+        score - score the docs of the shard, and return the number of relevant docs and their highest inner product.
+        rank - rank the scored docs with the highest inner product of all the shards, and return the top k.
+    """
+
+    def __init__(self, fn):
+        """
+        :param fn: prefix of the index files of the shard
+        """
+        self._indexer = Indexer(None)
+        self._indexer.load_index(fn)
+        self._ranker = Ranker(self._indexer)
+        self._corpus_ordinals = np.frombuffer(utils.load_obj(fn + '.ordinals.pkl'), dtype=np.int64)
+        # (doc ordinals, inner products, cos sims, dates) of the relevant docs of the last scored query.
+        self._relevant_doc_scores = None
+
+    def score(self, query_term_weights_dict, query_len_before_expension):
+        """
+        :param query_term_weights_dict: {term : w_iq ...} with the corpus idf
+        :param query_len_before_expension: number of query terms before expension
+        :return: (number of relevant docs of the shard, their highest inner product or None if there are none)
+        """
+        self._relevant_doc_scores = self._ranker.relevant_doc_scores(query_term_weights_dict,
+                                                                     query_len_before_expension)
+        inner_products = self._relevant_doc_scores[1]
+        max_inner_product = float(inner_products.max()) if len(inner_products) > 0 else None
+        return len(inner_products), max_inner_product
+
+    def rank(self, max_inner_product, k, high_similarity_only):
+        """
+        rank the docs of the last scored query.
+        :param max_inner_product: the highest inner product of the relevant docs of all the shards
+        :param k: number of top docs to return, None for all of them
+        :param high_similarity_only: remove the docs with rank <= 0.1 (some doc of the corpus has a higher rank)
+        :return: (ranks, dates, corpus ordinals, tweet ids) of the top k docs, sorted like Ranker.rank_relevant_docs
+        """
+        doc_ordinals, inner_products, cos_sims, dates = self._relevant_doc_scores
+        self._relevant_doc_scores = None
+        ranks = self._ranker.rank_combine(cos_sims, inner_products, max_inner_product)
+        if high_similarity_only:
+            high_similarity = ranks > 0.1
+            doc_ordinals = doc_ordinals[high_similarity]
+            ranks = ranks[high_similarity]
+            dates = dates[high_similarity]
+        corpus_ordinals = self._corpus_ordinals[doc_ordinals]
+        order = np.lexsort((corpus_ordinals, -dates, -ranks))
+        if k is not None:
+            order = order[:k]
+        return ranks[order], dates[order], corpus_ordinals[order], \
+            [self._indexer.get_tweet_id(doc_ordinal) for doc_ordinal in doc_ordinals[order]]
+
+
+def _serve_shard(fn, requests, results):
+    """
+    main function of a shard process: answer (method name, args) requests until the stop request (None).
+    :param fn: prefix of the index files of the shard
+    :param requests: connection that receives (method name, args)
+    :param results: connection that sends (result, exception)
+    :return:
+    """
+    shard_searcher = None
+    startup_exception = None
+    try:
+        shard_searcher = ShardSearcher(fn)
+    except Exception as e:
+        startup_exception = e
+    for method_name, args in iter(requests.recv, None):
+        if startup_exception is not None:
+            results.send((None, startup_exception))
+            continue
+        try:
+            results.send((getattr(shard_searcher, method_name)(*args), None))
+        except Exception as e:
+            results.send((None, e))
+
+
+class _ShardProcess:
+    """
+    ShardSearcher in its own process. request sends a call and response waits for its result,
+    so all the shards work on a phase at the same time.
+    response raises RuntimeError if the process exited (killed, out of memory) before it answered.
+    """
+
+    def __init__(self, fn):
+        requests_reader, self._requests = Pipe(duplex=False)
+        self._results, results_writer = Pipe(duplex=False)
+        self._process = Process(target=_serve_shard, args=(fn, requests_reader, results_writer), daemon=True)
+        self._process.start()
+        # the ends of the process are closed here, so they are closed when the process exits.
+        requests_reader.close()
+        results_writer.close()
+
+    def request(self, method_name, *args):
+        try:
+            self._requests.send((method_name, args))
+        except OSError as e:
+            raise RuntimeError('shard process exited: {}'.format(e))
+
+    def response(self):
+        # a result that was sent before the process exited is still in the connection.
+        wait([self._results, self._process.sentinel])
+        try:
+            result, exception = self._results.recv()
+        except EOFError:
+            self._process.join()
+            raise RuntimeError('shard process exited with code {} before it answered'.format(self._process.exitcode))
+        if exception is not None:
+            raise exception
+        return result
+
+    def close(self):
+        try:
+            self._requests.send(None)
+        except OSError:
+            pass
+        self._process.join()
+
+
+class _LocalShard:
+    """
+    ShardSearcher in the coordinator process, with the interface of _ShardProcess.
+    """
+
+    def __init__(self, fn):
+        self._shard_searcher = ShardSearcher(fn)
+        self._result = None
+
+    def request(self, method_name, *args):
+        self._result = getattr(self._shard_searcher, method_name)(*args)
+
+    def response(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class ShardedSearcher:
+    """
+    coordinator of a sharded index. the query is parsed, corrected, expanded and weighted once with the corpus
+    lexicon, and sent to all the shards in two phases:
+        1. every shard scores its docs and returns its highest inner product.
+        2. every shard ranks its docs with the highest inner product of all the shards (the normalization of
+           Ranker.rank_combine) and returns its top k, and the top k of the shards are merged.
+    the results are the same as the results of one index of all the corpus.
+    """
+
+    def __init__(self, shards_dir, parser, model=None, processes=True):
+        """
+        :param shards_dir: folder of the sharded index (build_shards)
+        :param parser: the parser of the search engine
+        :param model: the model of the searcher (expansion tables), None to use the live methods
+        :param processes: run every shard in its own process, False to search the shards in this process
+        """
+        n_shards, inverted_idx, number_of_documents = utils.load_obj(os.path.join(shards_dir, COORDINATOR_FILE + '.pkl'))
+        self.number_of_documents = number_of_documents
+        # indexer with the corpus lexicon only, for the query methods of the searcher.
+        self._lexicon_indexer = Indexer(None)
+        self._lexicon_indexer.inverted_idx = inverted_idx
+        # set the query methods (set_wordNet, set_spelling_correction ...) on it and call warm_up.
+        self.searcher = Searcher(parser, self._lexicon_indexer, model=model)
+        self._ranker = Ranker(self._lexicon_indexer)
+        shard_class = _ShardProcess if processes else _LocalShard
+        self._shards = [shard_class(shard_fn(shards_dir, shard)) for shard in range(n_shards)]
+        # the shards keep the scores of one query between the phases.
+        self._lock = threading.Lock()
+
+    def search(self, query, k=None):
+        """
+        :param query: query string
+        :param k: number of top results to return, default to everything.
+        :return: (number of relevant docs, list of tweet ids) like Searcher.search
+        """
+        query_as_dict, query_len, query_len_before_expension = self.searcher._normalized_query(query)
+        query_term_weights_dict = self._ranker.rank_tf_idf_query(query_as_dict, query_len)
+        with self._lock:
+            shard_scores = self._call_shards('score', query_term_weights_dict, query_len_before_expension)
+            n_relevant = sum(n_relevant_of_shard for n_relevant_of_shard, _ in shard_scores)
+            if n_relevant == 0:
+                return 0, []
+            max_inner_product = max(max_inner_of_shard for _, max_inner_of_shard in shard_scores
+                                     if max_inner_of_shard is not None)
+            # the doc with the highest inner product has rank of at least 0.2, so Ranker.rank_relevant_docs
+            # removes the docs with rank <= 0.1 unless the ranks are not numbers.
+            high_similarity_only = max_inner_product > 0
+            shard_top_docs = self._call_shards('rank', max_inner_product, k, high_similarity_only)
+
+        ranks = np.concatenate([top_docs[0] for top_docs in shard_top_docs])
+        dates = np.concatenate([top_docs[1] for top_docs in shard_top_docs])
+        corpus_ordinals = np.concatenate([top_docs[2] for top_docs in shard_top_docs])
+        tweet_ids = [tweet_id for top_docs in shard_top_docs for tweet_id in top_docs[3]]
+        order = np.lexsort((corpus_ordinals, -dates, -ranks))
+        if k is not None:
+            order = order[:k]
+        return n_relevant, [tweet_ids[idx] for idx in order]
+
+    def _call_shards(self, method_name, *args):
+        """
+        call a method of all the shards at the same time. the responses of all the shards are read before an
+        exception of a shard is raised, so no response is left for the next call.
+        :param method_name: name of the method of ShardSearcher
+        :param args: arguments of the method
+        :return: list of the results of the shards
+        """
+        results = []
+        first_exception = None
+        requested_shards = []
+        for shard in self._shards:
+            try:
+                shard.request(method_name, *args)
+                requested_shards.append(shard)
+            except Exception as e:
+                first_exception = first_exception or e
+        for shard in requested_shards:
+            try:
+                results.append(shard.response())
+            except Exception as e:
+                first_exception = first_exception or e
+        if first_exception is not None:
+            raise first_exception
+        return results
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,187 @@
+from array import array
+import disk_index
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+# shorter terms have too many terms in distance 2 to correct them.
+MIN_TERM_LENGTH = 3
+
+
+def deletes_of_word(word, max_edit_distance=MAX_EDIT_DISTANCE):
+    """
+    all the strings that are made by deleting up to max_edit_distance characters of the word.
+    :param word: the word
+    :param max_edit_distance: max number of deleted characters
+    :return: set of the deletes, the word itself included
+    """
+    deletes = {word}
+    edge = {word}
+    for _ in range(max_edit_distance):
+        next_edge = set()
+        for delete in edge:
+            if len(delete) <= 1:
+                continue
+            for idx in range(len(delete)):
+                next_edge.add(delete[:idx] + delete[idx + 1:])
+        next_edge -= deletes
+        deletes |= next_edge
+        edge = next_edge
+    return deletes
+
+
+def edit_distance(word, other, max_edit_distance=MAX_EDIT_DISTANCE):
+    """
+    damerau levenshtein distance (adjacent transpositions count as one edit).
+    :param word: first word
+    :param other: second word
+    :param max_edit_distance: distance above it is not interesting
+    :return: the distance, or max_edit_distance + 1 if the distance is bigger than max_edit_distance
+    """
+    if abs(len(word) - len(other)) > max_edit_distance:
+        return max_edit_distance + 1
+    previous_row = None
+    row = list(range(len(other) + 1))
+    for i in range(1, len(word) + 1):
+        before_previous_row, previous_row = previous_row, row
+        row = [i] + [0] * len(other)
+        for j in range(1, len(other) + 1):
+            cost = 0 if word[i - 1] == other[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and word[i - 1] == other[j - 2] and word[i - 2] == other[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        if min(row) > max_edit_distance:
+            return max_edit_distance + 1
+    return min(row[-1], max_edit_distance + 1)
+
+
+class SymSpellCorrector:
+    """
+    spelling corrector over the terms of the index (symmetric delete method).
+    every term is saved under the deletes of its prefix, so a misspelled word finds its candidates with
+    dictionary lookups of its own deletes instead of generating all the edits of the word.
+    the candidates are ranked by edit distance and then by the df of the term in the index.
+    """
+
+    def __init__(self, inverted_idx, max_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+        """
+        :param inverted_idx: {term : (df, idf)}
+        :param max_edit_distance: max edit distance between a word and its correction
+        :param prefix_length: only the prefix of the terms is used for the deletes
+        """
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.terms = []
+        self.dfs = array('I')
+        # {delete of a prefix : [term index ...]}
+        self.deletes = {}
+        for term in inverted_idx:
+            self.add_term(term, inverted_idx[term][0])
+
+    def add_term(self, term, df):
+        """
+        add a term of the index to the corrector.
+        the term is saved with its lower case form, so terms that are saved in capital letters are found too.
+        :param term: the term as it is saved in the index
+        :param df: number of docs of the term
+        :return:
+        """
+        term_idx = len(self.terms)
+        self.terms.append(term)
+        self.dfs.append(df)
+        for delete in deletes_of_word(term.lower()[:self.prefix_length], self.max_edit_distance):
+            if delete in self.deletes:
+                self.deletes[delete].append(term_idx)
+            else:
+                self.deletes[delete] = [term_idx]
+
+    def update_terms(self, inverted_idx, terms, renamed_terms=()):
+        """
+        update the corrector after a change of the index (appended segment), instead of building it again.
+        the corrector is the same as a corrector that is built from the changed index.
+        :param inverted_idx: {term : (df, idf)} of the changed index
+        :param terms: terms of the index that are new or that their df changed
+        :param renamed_terms: (old term, new term) of the terms that are saved in another form (capital letters
+                              term that is saved in lower case from now on)
+        :return:
+        """
+        term_indexes = {term: term_idx for term_idx, term in enumerate(self.terms)}
+        for old_term, new_term in renamed_terms:
+            if old_term in term_indexes:
+                # the deletes are of the lower case form, they stay the same.
+                term_idx = term_indexes.pop(old_term)
+                self.terms[term_idx] = new_term
+                term_indexes[new_term] = term_idx
+        for term in terms:
+            df = inverted_idx[term][0]
+            if term in term_indexes:
+                self.dfs[term_indexes[term]] = df
+            else:
+                term_indexes[term] = len(self.terms)
+                self.add_term(term, df)
+
+    def save(self, path):
+        """
+        save the tables of the corrector to a binary file that DiskSymSpellCorrector opens with mmap.
+        :param path: path of the file
+        :return:
+        """
+        disk_index.write_spelling_corrector(path, self.max_edit_distance, self.prefix_length, self.terms, self.dfs,
+                                            self.deletes)
+
+    def correction(self, word):
+        """
+        find the most likely term of the index for the word.
+        :param word: the word to correct
+        :return: the term of the index with the lowest edit distance (and highest df), None if there is no such term.
+        """
+        word = word.lower()
+        if len(word) < MIN_TERM_LENGTH:
+            return None
+        word_prefix = word[:self.prefix_length]
+        best_term = None
+        best_key = None
+        checked_terms = set()
+        # the deletes with less deleted characters first, their terms can be closer to the word.
+        for delete in sorted(deletes_of_word(word_prefix, self.max_edit_distance), key=len, reverse=True):
+            if best_key is not None and len(word_prefix) - len(delete) > best_key[0]:
+                # the terms of the remaining deletes are farther than the best term.
+                break
+            for term_idx in self.deletes.get(delete, ()):
+                if term_idx in checked_terms:
+                    continue
+                checked_terms.add(term_idx)
+                term = self.terms[term_idx]
+                max_distance = best_key[0] if best_key is not None else self.max_edit_distance
+                distance = edit_distance(word, term.lower(), max_distance)
+                if distance > max_distance:
+                    continue
+                key = (distance, -self.dfs[term_idx], term)
+                if best_key is None or key < best_key:
+                    best_key = key
+                    best_term = term
+        return best_term
+
+
+class DiskSymSpellCorrector(SymSpellCorrector):
+    """
+    SymSpellCorrector over the file that SymSpellCorrector.save wrote. the file is opened with mmap, so only the
+    deletes that a correction looks up are read, and processes that open the same file share the page cache.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the file
+        """
+        self.max_edit_distance, self.prefix_length, self.terms, self.dfs, self.deletes = \
+            disk_index.read_spelling_corrector(path)
+
+    def update_terms(self, inverted_idx, terms, renamed_terms=()):
+        """
+        the tables of the file are read only, they are copied to memory on the first update.
+        see SymSpellCorrector.update_terms.
+        """
+        if not isinstance(self.deletes, dict):
+            self.terms = list(self.terms)
+            self.dfs = array('I', self.dfs)
+            self.deletes = {delete: list(term_indexes) for delete, term_indexes in self.deletes.items()}
+        super().update_terms(inverted_idx, terms, renamed_terms)
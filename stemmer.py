@@ -1,9 +1,24 @@
+from functools import lru_cache
 from nltk.stem import snowball
 
+# the stem of a token doesn't depend on its tweet, and the same tokens repeat in many tweets,
+# so the stems are kept in a bounded lru cache shared by all the stemmers.
+STEM_CACHE_SIZE = 2 ** 17
+_SNOWBALL_STEMMER = snowball.SnowballStemmer("english")
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token):
+    """
+    :param token: string of a token
+    :return: stemmed token
+    """
+    return _SNOWBALL_STEMMER.stem(token)
+
 
 class Stemmer:
     def __init__(self):
-        self.stemmer = snowball.SnowballStemmer("english")
+        self.stemmer = _SNOWBALL_STEMMER
 
     def stem_term(self, token):
         """
@@ -11,4 +26,4 @@ class Stemmer:
         :param token: string of a token
         :return: stemmed token
         """
-        return self.stemmer.stem(token)
+        return stem(token)